@@ -0,0 +1,90 @@
+"""
+Premium entitlements.
+
+Premium lasts PREMIUM_DURATION_DAYS from premium_activated_at, which a
+renewal paid early sets to the end of the current period. Gates call
+has_premium(), which caches when the user's premium ends (0 if they have
+none), so a check is a cache hit rather than a user-row read, and access
+stops the moment the period is over even if expire_premium() hasn't
+cleared is_premium yet. Saving a user (a completed payment, an admin
+edit) drops the cached entry; expire_premium() does so for each batch.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.utils import timezone
+
+NO_EXPIRY = float('inf')  # premium granted without an activation date (e.g. by an admin)
+EXPIRY_BATCH_SIZE = 1000
+
+
+def premium_period():
+    return timedelta(days=settings.PREMIUM_DURATION_DAYS)
+
+
+def premium_expires_at(is_premium, activated_at):
+    """When premium ends, or None if the user isn't premium or it never ends"""
+    if not is_premium or activated_at is None:
+        return None
+    return activated_at + premium_period()
+
+
+def renewal_start(is_premium, activated_at):
+    """
+    Where a newly paid period starts counting from: the end of the current
+    period while one is running, so paying early adds a full period instead
+    of discarding the days left, otherwise now. Premium that never expires
+    stays that way (None).
+    """
+    if is_premium and activated_at is None:
+        return None
+    expires_at = premium_expires_at(is_premium, activated_at)
+    now = timezone.now()
+    return max(expires_at, now) if expires_at else now
+
+
+def _cache_key(user_id):
+    return f'entitlements:premium:{user_id}'
+
+
+def _expiry_timestamp(is_premium, activated_at):
+    if not is_premium:
+        return 0
+    expires_at = premium_expires_at(is_premium, activated_at)
+    return expires_at.timestamp() if expires_at else NO_EXPIRY
+
+
+def has_premium(user_id):
+    """Whether the user's premium is active now; cached by user id"""
+    key = _cache_key(user_id)
+    expires = cache.get(key)
+    if expires is None:
+        # Read from the primary even in replica-routed views: a lagging replica
+        # just after a payment would otherwise be cached for the whole timeout
+        users = get_user_model().objects.using('default')
+        row = users.filter(pk=user_id).values_list('is_premium', 'premium_activated_at').first()
+        expires = _expiry_timestamp(*row) if row else 0
+        cache.set(key, expires, settings.ENTITLEMENT_CACHE_TIMEOUT)
+    return expires > time.time()
+
+
+def invalidate_entitlements(*user_ids):
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids])
+
+
+def expire_premium(batch_size=EXPIRY_BATCH_SIZE):
+    """
+    Clear is_premium for users whose period has ended, with one UPDATE per
+    batch rather than a save per user. Returns the number of users expired.
+    """
+    users = get_user_model().objects
+    lapsed = users.filter(is_premium=True, premium_activated_at__lt=timezone.now() - premium_period())
+    expired = 0
+    while ids := list(lapsed.values_list('pk', flat=True)[:batch_size]):
+        # Re-check the cutoff in the UPDATE so a renewal in between isn't undone
+        expired += lapsed.filter(pk__in=ids).update(is_premium=False)
+        invalidate_entitlements(*ids)
+    return expired
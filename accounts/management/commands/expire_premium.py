@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.entitlements import EXPIRY_BATCH_SIZE, expire_premium
+
+
+class Command(BaseCommand):
+    """Run on a schedule (e.g. hourly cron) to clear lapsed premium flags"""
+    help = 'Expire premium for users whose premium period has ended'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=EXPIRY_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+        expired = expire_premium(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Expired premium for {expired} users.'))
@@ -0,0 +1,70 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.template.defaultfilters import filesizeformat
+
+from accounts.models import CustomUser
+from notes.models import Note
+
+
+class Command(BaseCommand):
+    """
+    Rebuild every user's storage_used from their notes' media sizes in one
+    UPDATE, then list the heaviest users. The counters are normally kept
+    current on save and delete; this repairs drift and fills in sizes for
+    attachments uploaded before they were tracked (--measure).
+    """
+    help = 'Recompute media storage usage for all users and report the heaviest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--measure', action='store_true',
+                            help='Re-read attachment sizes from storage before summing')
+        parser.add_argument('--top', type=int, default=10, help='How many users to list')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        if options['measure']:
+            measured, missing = self.measure(options['batch_size'])
+            self.stdout.write(f'Measured {measured} attachments ({missing} missing from storage).')
+
+        usage = Subquery(
+            Note.objects.filter(author=OuterRef('pk')).values('author')
+            .annotate(total=Sum('media_size')).values('total')
+        )
+        actual = Coalesce(usage, 0, output_field=models.BigIntegerField())
+        corrected = CustomUser.objects.exclude(storage_used=actual).update(storage_used=actual)
+        self.stdout.write(self.style.SUCCESS(f'Recomputed storage usage; {corrected} users corrected.'))
+
+        heaviest = CustomUser.objects.filter(storage_used__gt=0).order_by('-storage_used')[:options['top']]
+        for user in heaviest:
+            quota = user.storage_quota
+            share = f'{user.storage_used / quota:.0%} of quota' if quota else 'no quota'
+            self.stdout.write(f'{user.username:<30} {filesizeformat(user.storage_used):>10}  {share}')
+
+    def measure(self, batch_size):
+        """Set media_size from the stored files; returns (measured, missing) counts"""
+        notes = (Note.objects.exclude(media_file='').exclude(media_file__isnull=True)
+                 .only('pk', 'media_file', 'media_size').iterator(chunk_size=batch_size))
+        measured = missing = 0
+        changed = []
+        for note in notes:
+            try:
+                size = default_storage.size(note.media_file.name)
+            except OSError:
+                size = 0
+                missing += 1
+            measured += 1
+            if size != note.media_size:
+                note.media_size = size
+                changed.append(note)
+            if len(changed) >= batch_size:
+                Note.objects.bulk_update(changed, ['media_size'])
+                changed = []
+        if changed:
+            Note.objects.bulk_update(changed, ['media_size'])
+        return measured, missing
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_alter_customuser_username'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='storage_used',
+            field=models.PositiveBigIntegerField(default=0, help_text='Bytes of uploaded media, updated as attachments are added, replaced and removed'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_customuser_storage_used'),
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(condition=models.Q(('is_premium', True)), fields=['premium_activated_at'], name='premium_activated_idx'),
+        ),
+    ]
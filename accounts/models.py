@@ -1,5 +1,14 @@
+from django.conf import settings
+from functools import partial
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest
+from django.utils.functional import cached_property
+from . import entitlements
+
+class StorageQuotaExceeded(Exception):
+    """An upload would take the user past their storage quota"""
 
 class CustomUser(AbstractUser):
     """
@@ -21,10 +30,54 @@ class CustomUser(AbstractUser):
     )
     premium_activated_at = models.DateTimeField(null=True, blank=True)
     phone_number = models.CharField(max_length=15, blank=True, help_text="M-Pesa phone number")
+    storage_used = models.PositiveBigIntegerField(
+        default=0,
+        help_text="Bytes of uploaded media, updated as attachments are added, replaced and removed"
+    )
     
     def __str__(self):
         return self.username
     
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Premium may have changed (a payment, an admin edit)
+        transaction.on_commit(partial(entitlements.invalidate_entitlements, self.pk))
+    
+    @cached_property
+    def has_premium(self):
+        """Whether premium is active now; use this rather than is_premium for gates"""
+        return entitlements.has_premium(self.pk)
+    
+    @property
+    def premium_expires_at(self):
+        return entitlements.premium_expires_at(self.is_premium, self.premium_activated_at)
+    
+    @property
+    def storage_quota(self):
+        """Bytes of media this user may keep, by tier"""
+        return settings.STORAGE_QUOTA_PREMIUM if self.has_premium else settings.STORAGE_QUOTA_FREE
+    
+    @property
+    def storage_available(self):
+        return max(self.storage_quota - self.storage_used, 0)
+    
+    def adjust_storage(self, delta):
+        """
+        Add delta bytes (negative to release) to storage_used in one UPDATE.
+        Growth past the quota raises StorageQuotaExceeded; the check runs
+        against the stored counter, so concurrent uploads can't both slip in.
+        """
+        users = CustomUser.objects.filter(pk=self.pk)
+        if delta > 0:
+            users = users.filter(storage_used__lte=self.storage_quota - delta)
+        if not users.update(storage_used=Greatest(F('storage_used') + delta, Value(0))) and delta > 0:
+            raise StorageQuotaExceeded
+        self.storage_used = max(self.storage_used + delta, 0)
+    
     class Meta:
         verbose_name = 'User'
-        verbose_name_plural = 'Users'
\ No newline at end of file
+        verbose_name_plural = 'Users'
+        indexes = [
+            # Finds lapsed premium users for the expiry job
+            models.Index(fields=['premium_activated_at'], condition=Q(is_premium=True), name='premium_activated_idx'),
+        ]
\ No newline at end of file
@@ -0,0 +1,10 @@
+from datetime import timedelta
+
+from jobs.registry import task
+
+from . import entitlements
+
+
+@task(every=timedelta(hours=1))
+def expire_premium():
+    entitlements.expire_premium()
@@ -1,3 +1,99 @@
-from django.test import TestCase
+import tempfile
+from datetime import timedelta
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from notes.archive import import_notes
+from notes.models import Note
+from .models import CustomUser, StorageQuotaExceeded
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), STORAGE_QUOTA_PREMIUM=1000)
+class StorageAccountingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            username='uploader', password='pw', is_premium=True, premium_activated_at=timezone.now(),
+        )
+
+    def used(self):
+        return CustomUser.objects.get(pk=self.user.pk).storage_used
+
+    def attach(self, note, size, name='file.txt'):
+        note.media_file = ContentFile(b'x' * size, name=name)
+        with self.captureOnCommitCallbacks(execute=True):
+            note.save()
+
+    def create_note(self, size):
+        note = Note(author=self.user, title='Attached', content='Body')
+        self.attach(note, size)
+        return note
+
+    def test_upload_counts_its_bytes(self):
+        note = self.create_note(300)
+        self.assertEqual(self.used(), 300)
+        self.assertEqual(Note.objects.get(pk=note.pk).media_size, 300)
+
+    def test_replacing_an_attachment_counts_the_difference_and_deletes_the_old_file(self):
+        note = self.create_note(300)
+        old_name = note.media_file.name
+        self.attach(note, 100, name='smaller.txt')
+        self.assertEqual(self.used(), 100)
+        self.assertFalse(default_storage.exists(old_name))
+        self.assertTrue(default_storage.exists(note.media_file.name))
+
+    def test_edits_that_keep_the_attachment_leave_usage_alone(self):
+        note = Note.objects.get(pk=self.create_note(300).pk)
+        note.title = 'Renamed'
+        note.save()
+        note.content = 'New body'
+        note.save(update_fields=['content'])
+        self.assertEqual(self.used(), 300)
+
+    def test_deleting_a_note_releases_its_bytes_and_file(self):
+        note = self.create_note(300)
+        name = note.media_file.name
+        with self.captureOnCommitCallbacks(execute=True):
+            note.delete()
+        self.assertEqual(self.used(), 0)
+        self.assertFalse(default_storage.exists(name))
+
+    def test_upload_over_quota_is_refused_before_the_file_is_written(self):
+        self.create_note(800)
+        note = Note(author=self.user, title='Too big', content='Body')
+        with self.assertRaises(StorageQuotaExceeded):
+            self.attach(note, 300, name='too-big.txt')
+        self.assertEqual(self.used(), 800)
+        self.assertFalse(Note.objects.filter(title='Too big').exists())
+        self.assertFalse(default_storage.exists(f'notes/{self.user.username}/too-big.txt'))
+
+    def test_lapsed_premium_has_no_quota(self):
+        self.user.premium_activated_at = timezone.now() - timedelta(days=400)
+        self.user.save()
+        cache.clear()
+        with self.assertRaises(StorageQuotaExceeded):
+            CustomUser.objects.get(pk=self.user.pk).adjust_storage(1)
+
+    def test_release_never_goes_below_zero(self):
+        self.user.adjust_storage(-50)
+        self.assertEqual(self.used(), 0)
+
+    def test_import_counts_attachments_and_drops_those_over_quota(self):
+        def record(title, size):
+            return {
+                'title': title, 'content': 'Body', 'media': f'media/1/{title}.pdf', 'media_size': size,
+                'open_media': lambda: ContentFile(b'x' * size),
+            }
+
+        created, skipped = import_notes(self.user, [record('fits', 600), record('overflows', 600)])
+        self.assertEqual((created, skipped), (2, 0))
+        self.assertEqual(self.used(), 600)
+        self.assertEqual(Note.objects.get(title='fits').media_size, 600)
+        overflow = Note.objects.get(title='overflows')
+        self.assertFalse(overflow.media_file)
+        self.assertEqual(overflow.media_size, 0)
@@ -2,6 +2,7 @@ from django.shortcuts import render, redirect
 from django.contrib.auth import login as auth_login
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from kitabu_project.db_router import replica_reads
 from .forms import CustomUserCreationForm, CustomUserLoginForm
 
 def register(request):
@@ -36,6 +37,7 @@ def login(request):
     return render(request, 'accounts/login.html', {'form': form})
 
 @login_required
+@replica_reads
 def profile(request):
     """User profile with premium status"""
     return render(request, 'accounts/profile.html', {
@@ -0,0 +1,101 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    """
+    Measure how many concurrent connections a running Kitabu server can handle.
+    Point it at the sync (WSGI) and the ASGI deployment in turn and compare.
+    """
+    help = 'Hit a URL with increasing numbers of concurrent connections and report throughput/latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='Full http:// URL to request, e.g. http://127.0.0.1:8000/notes/')
+        parser.add_argument(
+            '--concurrency', default='10,50,200',
+            help='Comma-separated concurrency levels to test (default: 10,50,200)'
+        )
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per level (default: 10)')
+        parser.add_argument('--timeout', type=float, default=30.0, help='Per-request timeout in seconds')
+        parser.add_argument('--cookie', default='', help='Cookie header to send, e.g. "sessionid=..."')
+
+    def handle(self, *args, **options):
+        parts = urlsplit(options['url'])
+        if parts.scheme != 'http' or not parts.hostname:
+            raise CommandError('Only plain http:// URLs are supported.')
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError('--concurrency must be a comma-separated list of integers.')
+
+        target = {
+            'host': parts.hostname,
+            'port': parts.port or 80,
+            'path': (parts.path or '/') + (f'?{parts.query}' if parts.query else ''),
+            'cookie': options['cookie'],
+            'timeout': options['timeout'],
+        }
+
+        self.stdout.write(f"Load testing {options['url']}")
+        self.stdout.write(f"{'conns':>6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'errors':>7}")
+        for level in levels:
+            latencies, errors, elapsed = asyncio.run(
+                self._run_level(target, level, options['duration'])
+            )
+            if latencies:
+                ordered = sorted(latencies)
+                p50 = statistics.median(ordered) * 1000
+                p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000
+                worst = ordered[-1] * 1000
+            else:
+                p50 = p95 = worst = 0.0
+            self.stdout.write(
+                f"{level:>6} {len(latencies) / elapsed:>9.1f} {p50:>9.1f} {p95:>9.1f} {worst:>9.1f} {errors:>7}"
+            )
+
+    async def _run_level(self, target, concurrency, duration):
+        latencies = []
+        errors = 0
+        deadline = time.perf_counter() + duration
+
+        async def client():
+            nonlocal errors
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    status = await asyncio.wait_for(self._request(target), target['timeout'])
+                except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+                    errors += 1
+                    continue
+                if status >= 500:
+                    errors += 1
+                else:
+                    latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        return latencies, errors, time.perf_counter() - started
+
+    async def _request(self, target):
+        """Send one HTTP/1.1 GET on a fresh connection and return the status code"""
+        reader, writer = await asyncio.open_connection(target['host'], target['port'])
+        try:
+            headers = [
+                f"GET {target['path']} HTTP/1.1",
+                f"Host: {target['host']}",
+                'Connection: close',
+            ]
+            if target['cookie']:
+                headers.append(f"Cookie: {target['cookie']}")
+            writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode())
+            await writer.drain()
+            status_line = await reader.readline()
+            status = int(status_line.split()[1])
+            await reader.read()  # drain the body so timing covers the full response
+            return status
+        finally:
+            writer.close()
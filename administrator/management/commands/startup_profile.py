@@ -0,0 +1,64 @@
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What a worker does before serving its first request: load the app and
+# the URLconf, which imports every view module
+BOOT_SCRIPT = '''
+import kitabu_project.{app}
+from django.urls import get_resolver
+get_resolver().url_patterns
+'''
+
+
+class Command(BaseCommand):
+    """
+    Boot the project in a fresh interpreter with -X importtime and
+    summarise where the time goes, per module and per top-level package.
+    """
+    help = 'Report import time per module for a worker boot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app', choices=['wsgi', 'asgi'], default='wsgi')
+        parser.add_argument('--top', type=int, default=20, help='Rows to show in each table')
+        parser.add_argument('--sort', choices=['cumulative', 'self'], default='cumulative')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', BOOT_SCRIPT.format(app=options['app'])],
+            capture_output=True, text=True, cwd=settings.BASE_DIR,
+        )
+        elapsed = time.perf_counter() - started
+        if result.returncode:
+            raise CommandError(f'Boot failed:\n{result.stderr[-2000:]}')
+
+        modules = []  # (self us, cumulative us, module)
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:'):
+                continue
+            self_us, cumulative_us, module = line[len('import time:'):].split('|')
+            if self_us.strip().isdigit():
+                modules.append((int(self_us), int(cumulative_us), module.strip()))
+
+        total = sum(row[0] for row in modules)
+        self.stdout.write(
+            f'{options["app"]} boot: {elapsed * 1000:.0f} ms wall, '
+            f'{total / 1000:.0f} ms importing {len(modules)} modules\n'
+        )
+
+        key = 0 if options['sort'] == 'self' else 1
+        self.stdout.write(f'{"cumulative":>12} {"self":>10}  module')
+        for self_us, cumulative_us, module in sorted(modules, key=lambda row: row[key], reverse=True)[:options['top']]:
+            self.stdout.write(f'{cumulative_us / 1000:>10.1f}ms {self_us / 1000:>8.1f}ms  {module}')
+
+        packages = defaultdict(int)
+        for self_us, _, module in modules:
+            packages[module.split('.')[0]] += self_us
+        self.stdout.write(f'\n{"self":>12}  package')
+        for package, self_us in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:options['top']]:
+            self.stdout.write(f'{self_us / 1000:>10.1f}ms  {package}')
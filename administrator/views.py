@@ -1,6 +1,34 @@
+from datetime import timedelta
 from django.shortcuts import render
 from django.contrib.auth.decorators import user_passes_test
+from django.db.models import Count, Q, Sum
+from django.utils import timezone
+from accounts.models import CustomUser
+from kitabu_project.db_router import replica_reads
+from notes.models import Note
+from payments.models import Payment
 
 @user_passes_test(lambda u: u.is_staff)
+@replica_reads
 def admin_dashboard(request):
-    return render(request, 'administrator/dashboard.html')
\ No newline at end of file
+    """Staff overview of users, notes and payments, read from the replica when there is one"""
+    week_ago = timezone.now() - timedelta(days=7)
+    users = CustomUser.objects.aggregate(
+        total=Count('id'),
+        premium=Count('id', filter=Q(is_premium=True)),
+        joined_this_week=Count('id', filter=Q(date_joined__gte=week_ago)),
+    )
+    notes = Note.objects.aggregate(
+        total=Count('id'),
+        this_week=Count('id', filter=Q(created_at__gte=week_ago)),
+    )
+    payments = Payment.objects.filter(status='completed').aggregate(
+        count=Count('id'),
+        revenue=Sum('amount'),
+        revenue_this_week=Sum('amount', filter=Q(created_at__gte=week_ago)),
+    )
+    return render(request, 'administrator/dashboard.html', {
+        'users': users,
+        'notes': notes,
+        'payments': payments,
+    })
@@ -0,0 +1,31 @@
+"""
+Gunicorn settings, read automatically when gunicorn starts in this directory.
+
+With preload_app (on unless GUNICORN_PRELOAD=false) Django, the settings
+and every view module are imported once in the master and forked into the
+workers, which share that memory copy-on-write instead of each importing
+it at boot. The master closes its database connections before forking so
+no worker inherits a socket; the M-Pesa client rebuilds its HTTP session
+per process (see payments/mpesa.py).
+"""
+import gc
+import os
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() in ['true', '1', 't']
+
+
+def when_ready(server):
+    if not server.cfg.preload_app:
+        return
+    # Import all views now rather than on each worker's first request
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+    # Move everything loaded so far out of the collector's generations, so
+    # a worker's first collection doesn't write to (and un-share) its pages
+    gc.freeze()
+
+
+def pre_fork(server, worker):
+    if server.cfg.preload_app:
+        from django.db import connections
+        connections.close_all()
@@ -0,0 +1,40 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from jobs.registry import autodiscover
+from jobs.runner import Worker
+
+
+class Command(BaseCommand):
+    """
+    Run background jobs from the jobs table, including periodic ones.
+    Start as many workers as needed; they coordinate through the database.
+    """
+    help = 'Process queued background jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.JOBS_CONCURRENCY,
+                            help='Jobs to run at once (threads)')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Seconds to wait when nothing is due')
+        parser.add_argument('--metrics-interval', type=float, default=60,
+                            help='Seconds between throughput reports (0 to disable)')
+        parser.add_argument('--burst', action='store_true', help='Exit once no jobs are due')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency must be at least 1.')
+        autodiscover()
+
+        worker = Worker(
+            concurrency=options['concurrency'],
+            poll_interval=options['poll_interval'],
+            metrics_interval=options['metrics_interval'],
+            log=self.stdout.write,
+        )
+        # Finish running jobs before exiting on Ctrl-C or a platform shutdown
+        signal.signal(signal.SIGINT, worker.stop)
+        signal.signal(signal.SIGTERM, worker.stop)
+        worker.run(burst=options['burst'])
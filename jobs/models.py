@@ -0,0 +1,47 @@
+from django.db import models
+from django.utils import timezone
+
+class Job(models.Model):
+    """
+    A unit of deferred work for the `manage.py worker` runner. kwargs are
+    passed to the registered task called name (see jobs/registry.py).
+    A running job holds a lease (locked_until) that its worker keeps
+    renewing; if the worker dies the lease runs out and the job is retried.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    DEAD = 'dead'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (DEAD, 'Dead'),  # failed max_attempts times; kept for inspection
+    ]
+    
+    name = models.CharField(max_length=200)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    run_at = models.DateTimeField(default=timezone.now)
+    # Enqueueing a job whose key is already taken is a no-op (used for periodic runs)
+    unique_key = models.CharField(max_length=200, unique=True, null=True, blank=True)
+    
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    last_error = models.TextField(blank=True)
+    locked_by = models.CharField(max_length=64, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+            models.Index(fields=['status', 'locked_until']),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
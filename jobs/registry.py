@@ -0,0 +1,71 @@
+"""
+Task registry for the job runner.
+
+Apps define tasks in a tasks.py module (imported by the worker at start):
+
+    @task(max_attempts=3)
+    def send_report(user_id): ...
+
+    send_report.defer(user_id=user.pk)                    # run soon
+    send_report.defer(run_at=tomorrow, user_id=user.pk)   # run later
+
+@task(every=timedelta(hours=1)) makes a periodic task, enqueued by the
+worker once per interval. Task arguments must be JSON-serialisable.
+"""
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from .models import Job
+
+_tasks = {}
+
+
+class Task:
+    def __init__(self, func, name, max_attempts, every):
+        self.func = func
+        self.name = name
+        self.max_attempts = max_attempts
+        self.every = every
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def defer(self, *, run_at=None, unique_key=None, **kwargs):
+        """Queue a run; inside a transaction the job only exists if it commits"""
+        job = Job(
+            name=self.name,
+            kwargs=kwargs,
+            run_at=run_at or timezone.now(),
+            unique_key=unique_key,
+            max_attempts=self.max_attempts,
+        )
+        Job.objects.bulk_create([job], ignore_conflicts=unique_key is not None)
+        return job
+
+
+def task(func=None, *, name=None, max_attempts=None, every=None):
+    """Register a function as a task (usable with or without arguments)"""
+    def register(func):
+        registered = Task(
+            func,
+            name or f'{func.__module__}.{func.__name__}',
+            max_attempts or settings.JOBS_MAX_ATTEMPTS,
+            every,
+        )
+        _tasks[registered.name] = registered
+        return registered
+    return register(func) if func else register
+
+
+def get_task(name):
+    return _tasks.get(name)
+
+
+def periodic_tasks():
+    return [registered for registered in _tasks.values() if registered.every]
+
+
+def autodiscover():
+    """Import every installed app's tasks module"""
+    autodiscover_modules('tasks')
@@ -0,0 +1,214 @@
+"""
+The worker behind `manage.py worker`.
+
+Jobs are claimed in small batches. On PostgreSQL the claim is
+SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers never wait on (or
+take) each other's rows. SQLite has no row locks; there the claim is a
+conditional UPDATE of rows still queued, which is safe because SQLite
+serialises writes. Either way a claimed job carries a lease (locked_until)
+that the worker renews while the job runs. If a worker dies, its leases run
+out and the jobs are picked up again, or dead-lettered once out of attempts.
+"""
+import os
+import socket
+import time
+import traceback
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+from .registry import get_task, periodic_tasks
+
+HOUSEKEEPING_INTERVAL = 10  # seconds between lease renewal / recovery / scheduling passes
+
+
+def retry_delay(attempts):
+    """Backoff before retrying: base, 2x base, 4x base ... capped at an hour"""
+    return timedelta(seconds=min(settings.JOBS_RETRY_BASE * 2 ** (attempts - 1), 3600))
+
+
+def _lease(now):
+    return now + timedelta(seconds=settings.JOBS_LEASE)
+
+
+def claim(worker_id, limit):
+    """Take up to limit due jobs for this worker and return them"""
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_at__lte=now).order_by('run_at', 'pk')
+    claimed = {
+        'status': Job.RUNNING,
+        'locked_by': worker_id,
+        'locked_until': _lease(now),
+        'started_at': now,
+        'attempts': F('attempts') + 1,
+    }
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(due.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+            Job.objects.filter(pk__in=ids).update(**claimed)
+    else:
+        ids = list(due.values_list('pk', flat=True)[:limit])
+        due.filter(pk__in=ids).update(**claimed)  # rows another worker took meanwhile no longer match
+    if not ids:
+        return []
+    return list(Job.objects.filter(pk__in=ids, status=Job.RUNNING, locked_by=worker_id))
+
+
+def recover_expired():
+    """Requeue jobs whose worker stopped renewing the lease, dead-lettering any out of attempts"""
+    now = timezone.now()
+    expired = Job.objects.filter(status=Job.RUNNING, locked_until__lt=now)
+    error = 'Lease expired; the worker running this job stopped.'
+    dead = expired.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.DEAD, locked_by='', locked_until=None, finished_at=now, last_error=error
+    )
+    requeued = expired.update(status=Job.QUEUED, locked_by='', locked_until=None, last_error=error)
+    return requeued, dead
+
+
+def execute(job):
+    """Run a claimed job and record the outcome; returns (status, seconds)"""
+    close_old_connections()
+    started = time.monotonic()
+    mine = Job.objects.filter(pk=job.pk, status=Job.RUNNING, locked_by=job.locked_by)
+    try:
+        registered = get_task(job.name)
+        if registered is None:
+            raise LookupError(f'No task named {job.name!r} is registered.')
+        registered.func(**job.kwargs)
+    except Exception:
+        now = timezone.now()
+        if job.attempts >= job.max_attempts:
+            status = Job.DEAD
+            mine.update(status=status, locked_by='', locked_until=None, finished_at=now,
+                        last_error=traceback.format_exc())
+        else:
+            status = Job.QUEUED
+            mine.update(status=status, locked_by='', locked_until=None, run_at=now + retry_delay(job.attempts),
+                        last_error=traceback.format_exc())
+    else:
+        status = Job.SUCCEEDED
+        mine.update(status=status, locked_by='', locked_until=None, finished_at=timezone.now(), last_error='')
+    finally:
+        close_old_connections()
+    return status, time.monotonic() - started
+
+
+class Metrics:
+    """Counts outcomes between reports"""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.monotonic()
+        self.counts = {Job.SUCCEEDED: 0, Job.QUEUED: 0, Job.DEAD: 0}
+        self.busy = 0.0
+
+    def record(self, status, seconds):
+        self.counts[status] += 1
+        self.busy += seconds
+
+    def report(self, queue_depth):
+        done = sum(self.counts.values())
+        elapsed = time.monotonic() - self.started
+        line = (
+            f'{done / elapsed if elapsed else 0:.1f} jobs/s over {elapsed:.0f}s: '
+            f'{self.counts[Job.SUCCEEDED]} succeeded, {self.counts[Job.QUEUED]} retrying, '
+            f'{self.counts[Job.DEAD]} dead; avg {self.busy / done * 1000 if done else 0:.0f} ms; '
+            f'{queue_depth} due'
+        )
+        self.reset()
+        return line
+
+
+class Worker:
+    def __init__(self, concurrency=4, poll_interval=1.0, metrics_interval=60, log=print):
+        self.id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.metrics_interval = metrics_interval
+        self.log = log
+        self.metrics = Metrics()
+        self.running = {}  # future -> job id
+        self.stopping = False
+        self._scheduled = {}  # periodic task name -> last slot enqueued
+        self._last_housekeeping = self._last_report = 0
+
+    def stop(self, *args):
+        """Finish the running jobs, claim no more, then exit (safe as a signal handler)"""
+        self.stopping = True
+
+    def schedule_periodic(self):
+        """Queue the current run of each periodic task; the unique key makes it once per interval"""
+        now = time.time()
+        for registered in periodic_tasks():
+            seconds = registered.every.total_seconds()
+            slot = int(now // seconds)
+            if self._scheduled.get(registered.name) != slot:
+                registered.defer(
+                    run_at=datetime.fromtimestamp(slot * seconds, tz=dt_timezone.utc),
+                    unique_key=f'periodic:{registered.name}:{slot}',
+                )
+                self._scheduled[registered.name] = slot
+
+    def housekeeping(self):
+        if self.running:
+            Job.objects.filter(pk__in=self.running.values(), status=Job.RUNNING, locked_by=self.id).update(
+                locked_until=_lease(timezone.now())
+            )
+        requeued, dead = recover_expired()
+        if requeued or dead:
+            self.log(f'Recovered {requeued} abandoned jobs ({dead} dead-lettered).')
+        self.schedule_periodic()
+
+    def collect(self, timeout):
+        done, _ = wait(list(self.running), timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            job_id = self.running.pop(future)
+            try:
+                self.metrics.record(*future.result())
+            except Exception as e:
+                # Couldn't record the outcome; the lease will expire and the job be retried
+                self.log(f'Job #{job_id} failed in the runner: {e}')
+
+    def report(self):
+        depth = Job.objects.filter(status=Job.QUEUED, run_at__lte=timezone.now()).count()
+        self.log(self.metrics.report(depth))
+
+    def run(self, burst=False):
+        """Process jobs until stopped; with burst, exit once nothing is due"""
+        self.log(f'Worker {self.id} started with {self.concurrency} threads.')
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='job') as pool:
+            while not self.stopping:
+                now = time.monotonic()
+                if now - self._last_housekeeping >= HOUSEKEEPING_INTERVAL:
+                    self.housekeeping()
+                    self._last_housekeeping = now
+                if self.metrics_interval and now - self._last_report >= self.metrics_interval:
+                    if self._last_report:
+                        self.report()
+                    self._last_report = now
+
+                free = self.concurrency - len(self.running)
+                jobs = claim(self.id, free) if free else []
+                for job in jobs:
+                    self.running[pool.submit(execute, job)] = job.pk
+
+                if burst and not jobs and not self.running:
+                    break
+                if self.running:
+                    # Wake as soon as a slot frees up; poll straight away if we just filled the pool
+                    self.collect(0 if jobs and len(jobs) == free else self.poll_interval)
+                elif not jobs:
+                    time.sleep(self.poll_interval)
+
+            while self.running:
+                self.collect(None)
+        self.report()
+        close_old_connections()
@@ -0,0 +1,18 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Job
+from .registry import task
+
+
+@task(every=timedelta(days=1))
+def prune_jobs():
+    """Delete succeeded jobs older than JOBS_RETENTION_DAYS, in batches"""
+    finished = Job.objects.filter(
+        status=Job.SUCCEEDED,
+        finished_at__lt=timezone.now() - timedelta(days=settings.JOBS_RETENTION_DAYS),
+    )
+    while ids := list(finished.values_list('pk', flat=True)[:1000]):
+        Job.objects.filter(pk__in=ids).delete()
@@ -0,0 +1,126 @@
+import threading
+from datetime import timedelta
+
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from .models import Job
+from .registry import task
+from .runner import Worker, claim, execute, recover_expired, retry_delay
+
+ran = []
+ran_lock = threading.Lock()
+
+
+@task(name='jobs.tests.record')
+def record(value):
+    with ran_lock:
+        ran.append(value)
+
+
+@task(name='jobs.tests.fail', max_attempts=2)
+def fail():
+    raise RuntimeError('boom')
+
+
+# execute() runs in the worker's pool threads on their own connections, so
+# these tests commit for real instead of running inside a test transaction
+class JobRunnerTests(TransactionTestCase):
+
+    def setUp(self):
+        ran.clear()
+
+    def test_claim_takes_due_jobs_once(self):
+        due = [record.defer(value=i) for i in range(3)]
+        record.defer(run_at=timezone.now() + timedelta(hours=1), value='later')
+
+        claimed = claim('worker-1', 10)
+        self.assertEqual(sorted(job.pk for job in claimed), sorted(job.pk for job in due))
+        for job in claimed:
+            self.assertEqual((job.status, job.attempts, job.locked_by), (Job.RUNNING, 1, 'worker-1'))
+            self.assertGreater(job.locked_until, timezone.now())
+        self.assertEqual(claim('worker-2', 10), [])
+
+    def test_claim_respects_limit(self):
+        for i in range(5):
+            record.defer(value=i)
+        self.assertEqual(len(claim('worker-1', 2)), 2)
+        self.assertEqual(len(claim('worker-2', 10)), 3)
+
+    def test_unique_key_queues_once(self):
+        record.defer(unique_key='once', value=1)
+        record.defer(unique_key='once', value=2)
+        self.assertEqual(Job.objects.filter(unique_key='once').count(), 1)
+
+    def test_execute_records_success(self):
+        record.defer(value='done')
+        [job] = claim('worker-1', 1)
+        status, _ = execute(job)
+        self.assertEqual(status, Job.SUCCEEDED)
+        self.assertEqual(ran, ['done'])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by, job.locked_until), (Job.SUCCEEDED, '', None))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_failure_is_retried_with_backoff_then_dead_lettered(self):
+        fail.defer()
+        [job] = claim('worker-1', 1)
+        before = timezone.now()
+        self.assertEqual(execute(job)[0], Job.QUEUED)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('RuntimeError: boom', job.last_error)
+        self.assertGreaterEqual(job.run_at, before + retry_delay(1))
+        self.assertEqual(claim('worker-1', 1), [])  # not due until the backoff passes
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        [job] = claim('worker-1', 1)
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual(execute(job)[0], Job.DEAD)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DEAD)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_backoff_doubles_and_is_capped(self):
+        self.assertEqual(retry_delay(2), 2 * retry_delay(1))
+        self.assertEqual(retry_delay(30), timedelta(hours=1))
+
+    def test_expired_lease_is_recovered(self):
+        record.defer(value='abandoned')
+        [job] = claim('dead-worker', 1)
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(recover_expired(), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (Job.QUEUED, ''))
+        self.assertIn('Lease expired', job.last_error)
+        self.assertEqual([j.pk for j in claim('worker-2', 1)], [job.pk])
+
+    def test_expired_lease_out_of_attempts_is_dead_lettered(self):
+        fail.defer()
+        Job.objects.update(attempts=1)
+        [job] = claim('dead-worker', 1)
+        Job.objects.filter(pk=job.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(recover_expired(), (0, 1))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DEAD)
+
+    def test_live_lease_is_not_recovered(self):
+        record.defer(value='busy')
+        claim('worker-1', 1)
+        self.assertEqual(recover_expired(), (0, 0))
+
+    def test_worker_burst_runs_every_due_job_once(self):
+        for i in range(20):
+            record.defer(value=i)
+        fail.defer()
+        logs = []
+        Worker(concurrency=2, poll_interval=0.01, metrics_interval=0, log=logs.append).run(burst=True)
+
+        self.assertEqual(sorted(ran), list(range(20)))
+        mine = Job.objects.filter(name='jobs.tests.record')
+        self.assertEqual(mine.filter(status=Job.SUCCEEDED, attempts=1).count(), 20)
+        # The failing job is waiting out its backoff, which burst mode doesn't wait for
+        self.assertEqual(Job.objects.get(name='jobs.tests.fail').status, Job.QUEUED)
+        self.assertIn('1 retrying, 0 dead', logs[-1])
@@ -0,0 +1,91 @@
+"""
+Read-replica routing.
+
+When DATABASE_REPLICA_URL is set, views wrapped in replica_reads (note
+listings, profile counts, staff reports) read from the 'replica' database;
+every other read and all writes use 'default'. A replica lags the primary
+slightly, so PrimaryPinningMiddleware sets a short-lived cookie on every
+write request, and while it is present replica_reads leaves the user on the
+primary: a note they just saved is listed straight away.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from inspect import iscoroutinefunction
+
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+REPLICA = 'replica'
+PIN_COOKIE = 'kitabu_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+# A context variable rather than a thread-local so it follows async views
+# across awaits and into sync_to_async calls without leaking between requests
+_use_replica = ContextVar('use_replica', default=False)
+
+
+def replica_configured():
+    return REPLICA in settings.DATABASES
+
+
+@contextmanager
+def read_from_replica():
+    """Send reads inside the block to the replica, if one is configured"""
+    token = _use_replica.set(replica_configured())
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def is_pinned(request):
+    """Whether request must read from the primary to see the user's own writes"""
+    return request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES
+
+
+def replica_reads(view_func):
+    """Run a read-only view against the replica unless the user just wrote"""
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _wrapped_view(request, *args, **kwargs):
+            if is_pinned(request):
+                return await view_func(request, *args, **kwargs)
+            with read_from_replica():
+                return await view_func(request, *args, **kwargs)
+    else:
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            if is_pinned(request):
+                return view_func(request, *args, **kwargs)
+            with read_from_replica():
+                return view_func(request, *args, **kwargs)
+    return _wrapped_view
+
+
+class ReplicaRouter:
+    """Reads go to the replica inside read_from_replica(), everything else to the primary"""
+
+    def db_for_read(self, model, **hints):
+        return REPLICA if _use_replica.get() else 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # the replica holds the same rows as the primary
+
+
+class PrimaryPinningMiddleware(MiddlewareMixin):
+    """Pin the client to the primary for REPLICA_PIN_SECONDS after any write request"""
+
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS and replica_configured():
+            response.set_cookie(
+                PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS,
+                secure=request.is_secure(),
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
@@ -0,0 +1,44 @@
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+# Brotli is optional; without it API responses fall back to gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+re_accepts_brotli = _lazy_re_compile(r'\bbr\b')
+
+
+class APICompressionMiddleware(GZipMiddleware):
+    """
+    Compress JSON API responses with brotli when the client accepts it,
+    gzip otherwise. Only applies under /api/: HTML pages carry CSRF tokens,
+    and compressing those would expose them to BREACH-style attacks.
+    """
+    brotli_quality = 5
+
+    def process_response(self, request, response):
+        if not request.path.startswith('/api/'):
+            return response
+        if brotli is None or response.streaming or response.has_header('Content-Encoding'):
+            return super().process_response(request, response)
+        if len(response.content) < 200:
+            return response
+        
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if not re_accepts_brotli.search(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            return super().process_response(request, response)
+        
+        compressed_content = brotli.compress(response.content, quality=self.brotli_quality)
+        if len(compressed_content) >= len(response.content):
+            return response
+        response.content = compressed_content
+        response.headers['Content-Length'] = str(len(response.content))
+        
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
@@ -1,6 +1,7 @@
 # kitabu_project/settings.py
 
 import os
+from importlib.util import find_spec
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -30,26 +31,35 @@ INSTALLED_APPS = [
     'notes.apps.NotesConfig',
     'payments.apps.PaymentsConfig',
     'administrator.apps.AdministratorConfig',
+    'notifications.apps.NotificationsConfig',
+    'jobs.apps.JobsConfig',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'kitabu_project.middleware.APICompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'kitabu_project.db_router.PrimaryPinningMiddleware',
 ]
 
-# Add WhiteNoise middleware if available (for production static files)
-try:
-    import whitenoise.middleware
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# Add WhiteNoise middleware if available (for production static files).
+# find_spec checks it is installed without importing it at settings time.
+# collectstatic then writes minified, fingerprinted files with .gz/.br
+# copies, and WhiteNoise serves the fingerprinted names as immutable.
+if find_spec('whitenoise') is not None:
     MIDDLEWARE.insert(1, 'whitenoise.middleware.WhiteNoiseMiddleware')
-    STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+    STORAGES['staticfiles'] = {'BACKEND': 'kitabu_project.storage.MinifiedStaticFilesStorage'}
     WHITENOISE_USE_FINDERS = True
-except ImportError:
-    pass
 
 ROOT_URLCONF = 'kitabu_project.urls'
 
@@ -79,6 +89,9 @@ try:
             default=f'sqlite:///{BASE_DIR / "db.sqlite3"}'
         )
     }
+    # Optional read replica for listings and reports (see kitabu_project/db_router.py)
+    if os.getenv('DATABASE_REPLICA_URL'):
+        DATABASES['replica'] = dj_database_url.parse(os.getenv('DATABASE_REPLICA_URL'))
 except ImportError:
     DATABASES = {
         'default': {
@@ -87,6 +100,15 @@ except ImportError:
         }
     }
 
+# Tests run against a file rather than SQLite's shared in-memory database:
+# the job runner tests write from several threads, and the in-memory database
+# fails on lock contention instead of waiting. TEST is only read by test runs.
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    DATABASES['default'].setdefault('TEST', {}).setdefault('NAME', str(BASE_DIR / 'test_db.sqlite3'))
+
+DATABASE_ROUTERS = ['kitabu_project.db_router.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', 10))  # reads stay on the primary this long after a write
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -114,6 +136,23 @@ MEDIA_ROOT = BASE_DIR / 'media'
 FILE_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
 
+# Premium entitlements: how long a payment lasts, and how long a user's
+# entitlement is cached (per process unless REDIS_URL is set)
+PREMIUM_DURATION_DAYS = int(os.getenv('PREMIUM_DURATION_DAYS', 30))
+ENTITLEMENT_CACHE_TIMEOUT = 300  # seconds
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',  # needs the redis package
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+
+# Media storage quotas (bytes) by tier; free accounts can't upload media
+STORAGE_QUOTA_FREE = 0
+STORAGE_QUOTA_PREMIUM = int(os.getenv('STORAGE_QUOTA_PREMIUM', 500 * 1024 * 1024))  # 500MB
+
 # Custom user model
 AUTH_USER_MODEL = 'accounts.CustomUser'
 
@@ -122,6 +161,47 @@ LOGIN_REDIRECT_URL = 'notes:note_list'
 LOGOUT_REDIRECT_URL = 'home'
 LOGIN_URL = 'accounts:login'
 
+# Note change notifications (server-sent events).
+# The in-process backend only reaches clients connected to the same worker.
+NOTES_EVENT_BACKEND = os.getenv('NOTES_EVENT_BACKEND', 'notes.events.InProcessEventBackend')
+NOTES_EVENT_HEARTBEAT = 15  # seconds between keep-alive comments on idle streams
+
+# JSON API page sizes
+NOTES_API_PAGE_SIZE = 50
+NOTES_API_MAX_PAGE_SIZE = 200
+
+# Note revision history: revisions kept per note by tier, and how often
+# a full snapshot is stored between compressed deltas
+NOTES_REVISIONS_FREE = 20
+NOTES_REVISIONS_PREMIUM = 200
+NOTES_REVISION_SNAPSHOT_INTERVAL = 20
+
+# Background jobs (`manage.py worker`): default threads per worker, seconds a
+# running job's lease lasts without renewal, retry backoff base, and how long
+# finished jobs are kept
+JOBS_CONCURRENCY = int(os.getenv('JOBS_CONCURRENCY', 4))
+JOBS_LEASE = 300
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_BASE = 30
+JOBS_RETENTION_DAYS = 7
+
+# Notifications: outbox rows are sent by the worker (or `manage.py send_notifications`).
+# Locally, email goes to the console (or to files with the filebased backend
+# and EMAIL_FILE_PATH) and SMS to the console stub.
+SITE_URL = os.getenv('SITE_URL', 'http://localhost:8000')  # for links in messages
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+EMAIL_FILE_PATH = os.getenv('EMAIL_FILE_PATH', str(BASE_DIR / 'sent_emails'))
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'False').lower() in ['true', '1', 't']
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'Kitabu <webmaster@localhost>')
+SMS_BACKEND = os.getenv('SMS_BACKEND', 'notifications.sms.ConsoleSMSBackend')
+NOTIFICATIONS_MAX_ATTEMPTS = 5
+NOTIFICATIONS_RETRY_BASE = 60  # seconds before the first retry; doubles each time
+NOTIFICATIONS_COALESCE_SECONDS = 5  # notifications added within this window share one delivery job
+
 # M-Pesa Configuration
 MPESA_CONSUMER_KEY = os.getenv('MPESA_CONSUMER_KEY')
 MPESA_CONSUMER_SECRET = os.getenv('MPESA_CONSUMER_SECRET')
@@ -0,0 +1,39 @@
+"""
+Static files storage: WhiteNoise's fingerprinted (hashed-name) storage,
+which also writes .gz and .br copies at collectstatic time, plus
+minification of CSS and JS as the files are collected. The minifiers are
+optional, like brotli; without them files are collected as written.
+"""
+import os
+
+from django.core.files.base import ContentFile
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+MINIFIERS = {
+    '.css': rcssmin and rcssmin.cssmin,
+    '.js': rjsmin and rjsmin.jsmin,
+}
+
+
+class MinifiedStaticFilesStorage(CompressedManifestStaticFilesStorage):
+    def _save(self, name, content):
+        # Runs for the collected copy and again for each hashed copy, so the
+        # hash and the compressed variants are all of the minified text
+        minify = MINIFIERS.get(os.path.splitext(name)[1])
+        if minify and '.min.' not in name:
+            content.seek(0)  # hashing the name may have read it already
+            try:
+                content = ContentFile(minify(content.read().decode('utf-8')).encode('utf-8'))
+            except UnicodeDecodeError:
+                content.seek(0)
+        return super()._save(name, content)
@@ -0,0 +1,18 @@
+"""
+Settings for the test suite: the project settings plus a second database
+standing in for the read replica, so the routing tests in notes/tests.py run
+without DATABASE_REPLICA_URL, and plain static storage, since the manifest
+only exists after collectstatic. `manage.py test` picks this module up by
+default; other runners need DJANGO_SETTINGS_MODULE=kitabu_project.test_settings.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, DATABASES, STORAGES
+
+if 'replica' not in DATABASES:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': str(BASE_DIR / 'replica.sqlite3'),  # tests use an in-memory copy; never created
+    }
+
+# kitabu_project/tests.py checks what collectstatic writes with the real storage
+STORAGES = {**STORAGES, 'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}}
@@ -0,0 +1,60 @@
+import gzip
+import json
+import tempfile
+from pathlib import Path
+from unittest import skipIf
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.test import SimpleTestCase, override_settings
+
+from .middleware import brotli
+from .storage import MINIFIERS
+
+COLLECTED_STORAGE = {
+    **settings.STORAGES,
+    'staticfiles': {'BACKEND': 'kitabu_project.storage.MinifiedStaticFilesStorage'},
+}
+
+
+@override_settings(STORAGES=COLLECTED_STORAGE, STATIC_ROOT=tempfile.mkdtemp(), DEBUG=False)
+class CollectStaticTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        call_command('collectstatic', interactive=False, verbosity=0)
+        cls.root = Path(settings.STATIC_ROOT)
+        cls.manifest = json.loads((cls.root / 'staticfiles.json').read_text())['paths']
+
+    def collected(self, name):
+        hashed = self.manifest[name]
+        self.assertNotEqual(hashed, name)
+        return self.root / hashed
+
+    def test_bundles_are_minified_and_hashed(self):
+        for name in ('css/notes.css', 'js/kitabu.js'):
+            source = (settings.BASE_DIR / 'static' / name).read_text()
+            collected = self.collected(name).read_text()
+            minify = MINIFIERS[Path(name).suffix]
+            self.assertEqual(collected, minify(source) if minify else source)
+            self.assertLessEqual(len(collected), len(source))
+
+    def test_compressed_copies_are_written(self):
+        collected = self.collected('css/notes.css')
+        gzipped = collected.with_name(collected.name + '.gz')
+        self.assertEqual(gzip.decompress(gzipped.read_bytes()), collected.read_bytes())
+
+    @skipIf(brotli is None, 'Brotli is not installed')
+    def test_brotli_copies_are_written(self):
+        collected = self.collected('js/kitabu.js')
+        compressed = collected.with_name(collected.name + '.br')
+        self.assertEqual(brotli.decompress(compressed.read_bytes()), collected.read_bytes())
+
+    def test_urls_use_the_hashed_names(self):
+        self.assertEqual(staticfiles_storage.url('css/notes.css'), settings.STATIC_URL + self.manifest['css/notes.css'])
+
+    def test_uncollected_file_is_an_error(self):
+        with self.assertRaises(ValueError):
+            staticfiles_storage.url('css/missing.css')
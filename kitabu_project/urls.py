@@ -18,6 +18,9 @@ urlpatterns = [
     # App URLs
     path('notes/', include('notes.urls')),
     path('payments/', include('payments.urls')),
+    
+    # JSON API
+    path('api/v1/notes/', include('notes.api_urls')),
 ]
 
 # Serve media files in development
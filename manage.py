@@ -6,7 +6,9 @@ import sys
 
 def main():
     """Run administrative tasks."""
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kitabu_project.settings')
+    # The test suite adds a stand-in replica database (see kitabu_project/test_settings.py)
+    settings_module = 'kitabu_project.test_settings' if sys.argv[1:2] == ['test'] else 'kitabu_project.settings'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
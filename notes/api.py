@@ -0,0 +1,389 @@
+"""
+Versioned JSON API for notes, mounted at /api/v1/notes/.
+
+Built for the mobile client: responses can be trimmed with ?fields=,
+lists use keyset (cursor) pagination so deep pages stay cheap, and every
+note carries an ETag/Last-Modified derived from updated_at so unchanged
+data comes back as an empty 304. Compression is handled by
+kitabu_project.middleware.APICompressionMiddleware.
+"""
+import base64
+import binascii
+import hashlib
+import json
+from datetime import datetime
+from functools import wraps
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Prefetch, Q
+from django.http import HttpResponse, JsonResponse
+from django.urls import reverse
+from django.views.decorators.http import condition, require_http_methods
+
+from accounts.models import CustomUser
+from notifications.outbox import notify_note_shared
+from .forms import NoteForm, ShareNoteForm
+from .models import Note, NoteChange, NoteVersionConflict, Tag
+
+# API field -> model columns it needs, so sparse requests only load those columns
+FIELDS = {
+    'id': ['id'],
+    'title': ['title'],
+    'content': ['content'],
+    'author': ['author__username'],
+    'is_pinned': ['is_pinned'],
+    'version': ['version'],
+    'created_at': ['created_at'],
+    'updated_at': ['updated_at'],
+    'media_url': ['media_file'],
+    'notebook': ['notebook__name'],
+    'tags': [],
+    'shared_with': [],
+}
+
+
+def api_login_required(view):
+    """Like login_required, but answers 401 JSON instead of redirecting to a login page"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return JsonResponse({'error': 'Authentication required.'}, status=401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def _error(message, status=400, **extra):
+    return JsonResponse({'error': message, **extra}, status=status)
+
+
+def _parse_fields(request):
+    """Return the requested field list from ?fields=a,b,c (all fields if absent)"""
+    raw = request.GET.get('fields')
+    if not raw:
+        return list(FIELDS)
+    fields = [name.strip() for name in raw.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+    return fields
+
+
+def _select_fields(queryset, fields):
+    """Restrict a note queryset to the columns needed to render `fields`"""
+    columns = {'id', 'author_id', 'updated_at'}
+    for name in fields:
+        columns.update(FIELDS[name])
+    if 'author' in fields:
+        queryset = queryset.select_related('author')
+    if 'notebook' in fields:
+        queryset = queryset.select_related('notebook')
+    if 'tags' in fields:
+        queryset = queryset.prefetch_related(Prefetch('tags', queryset=Tag.objects.only('id', 'name')))
+    if 'shared_with' in fields:
+        queryset = queryset.prefetch_related(
+            Prefetch('shared_with', queryset=CustomUser.objects.only('id', 'username'))
+        )
+    return queryset.only(*columns)
+
+
+def serialize_note(note, fields, user):
+    data = {}
+    for name in fields:
+        if name == 'author':
+            data[name] = note.author.username
+        elif name == 'media_url':
+            data[name] = note.media_file.url if note.media_file else None
+        elif name == 'notebook':
+            data[name] = note.notebook.name if note.notebook_id else None
+        elif name == 'tags':
+            data[name] = [tag.name for tag in note.tags.all()]
+        elif name == 'shared_with':
+            # Only the author gets to see who else a note is shared with
+            if note.author_id == user.pk:
+                data[name] = [shared_user.username for shared_user in note.shared_with.all()]
+        elif name in ('created_at', 'updated_at'):
+            data[name] = getattr(note, name).isoformat()
+        else:
+            data[name] = getattr(note, name)
+    return data
+
+
+def _visible_notes(user, scope='all'):
+    if scope == 'own':
+        return Note.objects.filter(author=user)
+    if scope == 'shared':
+        return Note.objects.filter(shared_with=user)
+    return Note.objects.filter(Q(author=user) | Q(shared_with=user)).distinct()
+
+
+def _encode_cursor(note):
+    raw = json.dumps([note.updated_at.isoformat(), note.pk])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        updated_at, pk = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(updated_at), int(pk)
+    except (binascii.Error, ValueError, TypeError):
+        raise ValueError('Invalid cursor.')
+
+
+def _list_etag(request):
+    """
+    ETag for a list request: changes whenever any visible note is updated,
+    created or removed (count) and varies with the query string.
+    """
+    scope = request.GET.get('scope', 'all')
+    # values() keeps the DISTINCT subquery to the two columns it needs, not note bodies
+    summary = _visible_notes(request.user, scope).values('id', 'updated_at').aggregate(
+        latest=Max('updated_at'), total=Count('id', distinct=True)
+    )
+    latest = summary['latest'].timestamp() if summary['latest'] else 0
+    key = f"{summary['total']}-{latest}-{request.GET.urlencode()}"
+    return 'notes-' + hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+
+
+@condition(etag_func=_list_etag)
+def _note_list(request):
+    try:
+        fields = _parse_fields(request)
+        limit = min(int(request.GET.get('limit', settings.NOTES_API_PAGE_SIZE)), settings.NOTES_API_MAX_PAGE_SIZE)
+        if limit < 1:
+            raise ValueError('limit must be positive.')
+        scope = request.GET.get('scope', 'all')
+        if scope not in ('all', 'own', 'shared'):
+            raise ValueError('scope must be one of: all, own, shared.')
+        notes = _visible_notes(request.user, scope).order_by('-updated_at', '-id')
+        if request.GET.get('tag'):
+            notes = notes.filter(tags__owner=request.user, tags__name=request.GET['tag'])
+        if request.GET.get('notebook'):
+            notes = notes.filter(notebook__owner=request.user, notebook__name=request.GET['notebook'])
+        if request.GET.get('cursor'):
+            updated_at, pk = _decode_cursor(request.GET['cursor'])
+            notes = notes.filter(Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, id__lt=pk))
+    except ValueError as e:
+        return _error(str(e))
+
+    page = list(_select_fields(notes, fields)[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+
+    return JsonResponse({
+        'results': [serialize_note(note, fields, request.user) for note in page],
+        'next_cursor': _encode_cursor(page[-1]) if has_more else None,
+    })
+
+
+def _form_data(payload):
+    """Map API names onto NoteForm fields (notebook -> notebook_name, tag list -> tag_names)"""
+    data = dict(payload)
+    if 'notebook' in data:
+        data['notebook_name'] = data.pop('notebook') or ''
+    if 'tags' in data:
+        tags = data.pop('tags')
+        data['tag_names'] = ','.join(tags) if isinstance(tags, list) else tags
+    return data
+
+
+def _note_create(request):
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return _error('Body must be valid JSON.')
+    if not isinstance(payload, dict):
+        return _error('Body must be a JSON object.')
+
+    form = NoteForm(_form_data(payload), user=request.user)
+    if not form.is_valid():
+        return _error('Invalid note.', errors=form.errors)
+    note = form.save(commit=False)
+    note.author = request.user
+    note.save()
+    form.save_tags(note)
+
+    note = _select_fields(Note.objects.filter(pk=note.pk), list(FIELDS)).get()
+    response = JsonResponse(serialize_note(note, list(FIELDS), request.user), status=201)
+    response['Location'] = reverse('notes_api:note_detail', args=[note.pk])
+    return response
+
+
+@api_login_required
+@require_http_methods(['GET', 'HEAD', 'POST'])
+def note_collection(request):
+    """GET: list visible notes. POST: create a note."""
+    if request.method == 'POST':
+        return _note_create(request)
+    return _note_list(request)
+
+
+def _note_updated_at(request, pk):
+    """updated_at of a note the user can see (cached on the request), or None"""
+    if not hasattr(request, '_note_updated_at'):
+        request._note_updated_at = _visible_notes(request.user).filter(pk=pk).values_list(
+            'updated_at', flat=True
+        ).first()
+    return request._note_updated_at
+
+
+def _note_etag(request, pk):
+    updated_at = _note_updated_at(request, pk)
+    if updated_at is None:
+        return None
+    return f'note-{pk}-{updated_at.timestamp()}'
+
+
+def accept_weak_if_match(view):
+    """
+    Let If-Match carry the weak form of our ETags. Compression weakens the
+    tag on the way out (W/"note-..."), and Django's If-Match check only
+    accepts strong tags. Note ETags name a version of the note, not the
+    bytes sent, so the weak form is just as exact.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if_match = request.META.get('HTTP_IF_MATCH')
+        if if_match:
+            request.META['HTTP_IF_MATCH'] = ', '.join(
+                tag.strip().removeprefix('W/') for tag in if_match.split(',')
+            )
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+@api_login_required
+@require_http_methods(['GET', 'HEAD', 'PATCH', 'DELETE'])
+@accept_weak_if_match
+@condition(etag_func=_note_etag, last_modified_func=_note_updated_at)
+def note_detail(request, pk):
+    """
+    GET a note, PATCH some of title/content/is_pinned, or DELETE it.
+    Writes honour If-Match (weak or strong), and a "version" in the PATCH body is checked
+    against Note.version (409 if the note moved on).
+    """
+    if request.method in ('GET', 'HEAD'):
+        try:
+            fields = _parse_fields(request)
+        except ValueError as e:
+            return _error(str(e))
+        note = _select_fields(_visible_notes(request.user), fields).filter(pk=pk).first()
+        if note is None:
+            return _error('Note not found.', status=404)
+        return JsonResponse(serialize_note(note, fields, request.user))
+
+    note = Note.objects.filter(pk=pk, author=request.user).first()
+    if note is None:
+        return _error('Note not found.', status=404)
+
+    if request.method == 'DELETE':
+        note.delete()
+        return HttpResponse(status=204)
+
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return _error('Body must be valid JSON.')
+    if not isinstance(payload, dict):
+        return _error('Body must be a JSON object.')
+
+    form = NoteForm(instance=note, user=request.user)
+    current = {name: form[name].initial for name in ('title', 'content', 'is_pinned', 'notebook_name', 'tag_names')}
+    form = NoteForm({**current, **_form_data(payload)}, instance=note, user=request.user)
+    if not form.is_valid():
+        return _error('Invalid note.', errors=form.errors)
+
+    changed_fields = form.changed_model_fields
+    try:
+        with transaction.atomic():
+            note.lock_version(form.cleaned_data['version'] or note.version)
+            if changed_fields:
+                form.save(commit=False).save(update_fields=changed_fields)
+            form.save_tags(note)
+    except NoteVersionConflict as conflict:
+        return _error('Note was changed since this version.', status=409, version=conflict.current_version)
+
+    note = _select_fields(Note.objects.filter(pk=note.pk), list(FIELDS)).get()
+    return JsonResponse(serialize_note(note, list(FIELDS), request.user))
+
+
+@api_login_required
+@require_http_methods(['GET'])
+def note_sync(request):
+    """
+    Offline sync: return the notes created/updated and the ids deleted or
+    unshared since ?cursor= (omit it for a first sync). Store the returned
+    cursor and call again while has_more is true. Cost scales with what
+    changed, not with the size of the library.
+    """
+    try:
+        fields = _parse_fields(request)
+        cursor = int(request.GET.get('cursor', 0))
+        limit = min(int(request.GET.get('limit', settings.NOTES_API_MAX_PAGE_SIZE)), settings.NOTES_API_MAX_PAGE_SIZE)
+        if cursor < 0 or limit < 1:
+            raise ValueError('cursor and limit must be positive.')
+    except ValueError as e:
+        return _error(str(e))
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+
+    changes = list(
+        NoteChange.objects.filter(user=request.user, id__gt=cursor)
+        .order_by('id').values_list('id', 'note_id', 'action')[:limit + 1]
+    )
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+
+    # An upsert can outlive the user's access (an edit racing an unshare can
+    # replace their tombstone), so only notes they can still see are sent
+    upsert_ids = [note_id for _, note_id, action in changes if action == NoteChange.UPSERT]
+    visible = _visible_notes(request.user).filter(pk__in=upsert_ids)
+    notes = {note.pk: note for note in _select_fields(visible, fields)}
+    changed, deleted = [], []
+    for _, note_id, action in changes:
+        note = notes.get(note_id)
+        if action == NoteChange.UPSERT and note is not None:
+            changed.append(serialize_note(note, fields, request.user))
+        else:
+            deleted.append(note_id)
+
+    return JsonResponse({
+        'changed': changed,
+        'deleted': deleted,
+        'cursor': changes[-1][0] if changes else cursor,
+        'has_more': has_more,
+    })
+
+
+@api_login_required
+@require_http_methods(['POST', 'DELETE'])
+def note_share(request, pk):
+    """POST {"username": ...} to share a note (premium), DELETE the same body to unshare"""
+    note = Note.objects.filter(pk=pk, author=request.user).first()
+    if note is None:
+        return _error('Note not found.', status=404)
+    if request.method == 'POST' and not request.user.has_premium:
+        return _error('Sharing notes requires Premium.', status=403)
+
+    try:
+        payload = json.loads(request.body)
+    except ValueError:
+        return _error('Body must be valid JSON.')
+    form = ShareNoteForm(payload if isinstance(payload, dict) else {})
+    if not form.is_valid():
+        return _error('Invalid request.', errors=form.errors)
+
+    user = CustomUser.objects.filter(username=form.cleaned_data['username']).first()
+    if user is None:
+        return _error('User not found.', status=404)
+    if user == request.user:
+        return _error("You can't share a note with yourself.")
+
+    if request.method == 'POST':
+        with transaction.atomic():
+            note.shared_with.add(user)
+            notify_note_shared(note, user, request.user)
+    else:
+        note.shared_with.remove(user)
+    return JsonResponse({'id': note.pk, 'shared_with': list(note.shared_with.values_list('username', flat=True))})
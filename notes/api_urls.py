@@ -0,0 +1,11 @@
+from django.urls import path
+from . import api
+
+app_name = 'notes_api'
+
+urlpatterns = [
+    path('', api.note_collection, name='note_collection'),
+    path('sync/', api.note_sync, name='note_sync'),
+    path('<int:pk>/', api.note_detail, name='note_detail'),
+    path('<int:pk>/share/', api.note_share, name='note_share'),
+]
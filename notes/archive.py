@@ -0,0 +1,346 @@
+"""
+Bulk export and import of notes.
+
+Exports are generated while they stream: zipfile writes into a small
+buffer that is drained after every chunk, so memory use doesn't depend on
+how many notes or attachments a user has. Imports parse JSON, JSONL or
+Markdown (alone or inside a ZIP) and insert with bulk_create in batches,
+writing the tag-link, revision and sync-log rows that the signals would.
+Under ASGI the export generators are driven through aiter_chunks(), since
+Django would otherwise collect a sync iterator into one list before sending.
+"""
+import io
+import json
+import os
+import zipfile
+from collections import Counter, defaultdict
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from accounts.models import StorageQuotaExceeded
+
+from .models import Note, Notebook, NoteChange, NoteTag, Tag, note_media_path
+from .revisions import record_initial_revisions
+from .sync import lock_change_logs
+
+EXPORT_CHUNK_SIZE = 64 * 1024
+IMPORT_BATCH_SIZE = 500
+
+
+class _StreamBuffer:
+    """Write-only file object that collects bytes until drained"""
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _note_record(note):
+    record = {
+        'title': note.title,
+        'content': note.content,
+        'is_pinned': note.is_pinned,
+        'created_at': note.created_at.isoformat(),
+        'updated_at': note.updated_at.isoformat(),
+    }
+    if note.notebook_id:
+        record['notebook'] = note.notebook.name
+    tags = sorted(tag.name for tag in note.tags.all())
+    if tags:
+        record['tags'] = tags
+    if note.media_file:
+        record['media'] = f'media/{note.pk}/{os.path.basename(note.media_file.name)}'
+    return record
+
+
+def _user_notes(user):
+    notes = Note.objects.filter(author=user).select_related('notebook').prefetch_related('tags')
+    return notes.order_by('pk').iterator(chunk_size=IMPORT_BATCH_SIZE)
+
+
+def export_jsonl(user):
+    """Yield the user's notes as JSON lines"""
+    for note in _user_notes(user):
+        yield json.dumps(_note_record(note)) + '\n'
+
+
+def export_zip(user):
+    """
+    Yield a ZIP archive of the user's notes: notes.jsonl plus every
+    attachment under media/<note id>/.
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        attachments = []
+        with archive.open('notes.jsonl', 'w') as entry:
+            for note in _user_notes(user):
+                record = _note_record(note)
+                entry.write((json.dumps(record) + '\n').encode('utf-8'))
+                if 'media' in record:
+                    attachments.append((record['media'], note.media_file.name))
+                yield buffer.drain()
+
+        for archive_name, storage_name in attachments:
+            try:
+                source = default_storage.open(storage_name, 'rb')
+            except OSError:
+                continue  # file missing from storage; the note still references it
+            with source, archive.open(archive_name, 'w', force_zip64=True) as entry:
+                while chunk := source.read(EXPORT_CHUNK_SIZE):
+                    entry.write(chunk)
+                    yield buffer.drain()
+    yield buffer.drain()
+
+
+async def aiter_chunks(chunks):
+    """
+    Serve a sync export generator to an async response one chunk at a time.
+    Every step runs in the request's thread, so the notes query keeps its
+    connection and cursor between chunks.
+    """
+    step = sync_to_async(next)
+    done = object()
+    try:
+        while (chunk := await step(chunks, done)) is not done:
+            yield chunk
+    finally:
+        await sync_to_async(chunks.close)()  # release the cursor if the client went away
+
+
+def _parse_markdown(name, text):
+    """Title from the first '# ' heading (else the file name), the rest is content"""
+    lines = text.splitlines()
+    if lines and lines[0].startswith('# '):
+        return {'title': lines[0][2:].strip(), 'content': '\n'.join(lines[1:]).strip('\n')}
+    return {'title': os.path.splitext(os.path.basename(name))[0], 'content': text}
+
+
+def _parse_json(text):
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = data.get('notes', [data])
+    if not isinstance(data, list):
+        raise ValueError('JSON must be a note, a list of notes or {"notes": [...]}.')
+    return data
+
+
+def _iter_jsonl(binary_file):
+    """Stream records from a JSON-lines file without reading it all at once"""
+    for line in io.TextIOWrapper(binary_file, encoding='utf-8'):
+        if line.strip():
+            yield json.loads(line)
+
+
+def _extension(name):
+    return os.path.splitext(name)[1].lower()
+
+
+def _parse_text_file(name, text):
+    extension = _extension(name)
+    if extension == '.json':
+        return _parse_json(text)
+    if extension in ('.md', '.markdown', '.txt'):
+        return [_parse_markdown(name, text)]
+    return []
+
+
+def parse_archive(uploaded_file):
+    """
+    Yield note records from an uploaded .zip, .json, .jsonl or .md file.
+    Records may carry an 'open_media' callable (and 'media_size') when the
+    archive includes the attachment they reference.
+    """
+    name = uploaded_file.name or ''
+    if not zipfile.is_zipfile(uploaded_file):
+        uploaded_file.seek(0)
+        if _extension(name) == '.jsonl':
+            yield from _iter_jsonl(uploaded_file)
+        else:
+            yield from _parse_text_file(name, uploaded_file.read().decode('utf-8'))
+        return
+
+    uploaded_file.seek(0)
+    archive = zipfile.ZipFile(uploaded_file)
+    members = set(archive.namelist())
+    for member in archive.namelist():
+        if member.endswith('/') or member.startswith('media/'):
+            continue
+        if _extension(member) == '.jsonl':
+            records = _iter_jsonl(archive.open(member))
+        else:
+            records = _parse_text_file(member, archive.read(member).decode('utf-8'))
+        for record in records:
+            media = record.get('media') if isinstance(record, dict) else None
+            if media in members:
+                record['open_media'] = lambda media=media: archive.open(media)
+                record['media_size'] = archive.getinfo(media).file_size
+            yield record
+
+
+def _build_note(user, record):
+    if not isinstance(record, dict):
+        raise ValueError('Each note must be a JSON object.')
+    title = str(record.get('title') or '').strip()[:Note._meta.get_field('title').max_length]
+    content = record.get('content')
+    if not title or not isinstance(content, str):
+        raise ValueError('Each note needs a title and text content.')
+    return Note(author=user, title=title, content=content, is_pinned=bool(record.get('is_pinned', False)))
+
+
+def _restore_timestamps(note, record):
+    """Apply the record's exported created_at/updated_at to note; False if it has neither"""
+    restored = False
+    for field in ('created_at', 'updated_at'):
+        value = record.get(field)
+        try:
+            parsed = parse_datetime(value) if isinstance(value, str) else None
+        except ValueError:
+            parsed = None
+        if parsed is None:
+            continue
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        setattr(note, field, parsed)
+        restored = True
+    return restored
+
+
+def _record_labels(record):
+    """The record's notebook name and tag names, normalised as NoteForm does; malformed ones are ignored"""
+    notebook = record.get('notebook')
+    notebook = notebook.strip()[:Notebook._meta.get_field('name').max_length] if isinstance(notebook, str) else ''
+    tags = record.get('tags')
+    if not isinstance(tags, list):
+        tags = []
+    max_length = Tag._meta.get_field('name').max_length
+    tags = sorted({tag.strip().lower()[:max_length] for tag in tags if isinstance(tag, str) and tag.strip()})
+    return notebook, tags
+
+
+def _named_ids(model, user, names):
+    """Map name -> id of the user's notebooks or tags, creating missing ones in a single INSERT"""
+    if not names:
+        return {}
+    model.objects.bulk_create([model(owner=user, name=name) for name in names], ignore_conflicts=True)
+    return dict(model.objects.filter(owner=user, name__in=names).values_list('name', 'id'))
+
+
+def _link_tags(user, notes, tag_names):
+    """Tag freshly bulk-created notes, keeping Tag.note_count in step as the m2m signals would"""
+    tags = _named_ids(Tag, user, set().union(*tag_names))
+    links = [
+        NoteTag(note_id=note.pk, tag_id=tags[name], updated_at=note.updated_at)
+        for note, names in zip(notes, tag_names) for name in names
+    ]
+    if not links:
+        return
+    NoteTag.objects.bulk_create(links)
+    # One UPDATE per distinct increment rather than one per tag
+    tags_by_increment = defaultdict(list)
+    for tag_id, added in Counter(link.tag_id for link in links).items():
+        tags_by_increment[added].append(tag_id)
+    for added, tag_ids in tags_by_increment.items():
+        Tag.objects.filter(pk__in=tag_ids).update(note_count=F('note_count') + added)
+
+
+def _allowed_media(filename):
+    """Apply the media_file field validators (allowed extensions) to an archive member"""
+    try:
+        for validator in Note._meta.get_field('media_file').validators:
+            validator(File(None, filename))
+    except ValidationError:
+        return False
+    return True
+
+
+def _save_batch(user, batch, stored):
+    labels = [_record_labels(record) for _, record in batch]
+    notebooks = _named_ids(Notebook, user, {notebook for notebook, _ in labels if notebook})
+    for (note, _), (notebook, _) in zip(batch, labels):
+        note.notebook_id = notebooks.get(notebook)
+    notes = Note.objects.bulk_create([note for note, _ in batch])
+
+    # bulk_create stamps the auto_now fields with the current time, so the
+    # exported timestamps are written back along with the attachments below
+    dated = [note for note, record in batch if _restore_timestamps(note, record)]
+
+    # Attachments can only be stored once the notes have ids
+    with_media = []
+    for note, record in batch:
+        open_media = record.get('open_media')
+        if open_media is None or not user.has_premium:
+            continue
+        filename = os.path.basename(record['media'])
+        if not _allowed_media(filename):
+            continue
+        try:
+            # bulk_update bypasses Note.save(), so account for the bytes here
+            user.adjust_storage(record['media_size'])
+        except StorageQuotaExceeded:
+            continue  # over quota: keep the note, drop the attachment
+        with open_media() as source:
+            note.media_file.name = default_storage.save(note_media_path(note, filename), File(source, filename))
+        stored.append(note.media_file.name)
+        note.media_size = record['media_size']
+        with_media.append(note)
+
+    # One UPDATE for both; a note only in one list rewrites the other fields unchanged
+    fields = (['created_at', 'updated_at'] if dated else []) + (['media_file', 'media_size'] if with_media else [])
+    if fields:
+        Note.objects.bulk_update({note.pk: note for note in dated + with_media}.values(), fields)
+
+    # bulk_create skips post_save and m2m_changed, so write what the signal handlers would
+    _link_tags(user, notes, [tags for _, tags in labels])
+    record_initial_revisions(notes)
+    lock_change_logs([user.pk])
+    NoteChange.objects.bulk_create([
+        NoteChange(user_id=user.pk, note_id=note.pk, action=NoteChange.UPSERT) for note in notes
+    ])
+    return len(notes)
+
+
+def import_notes(user, records, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Create notes for user from parsed records in batches.
+    Returns (created, skipped) counts; malformed records are skipped.
+
+    Call inside transaction.atomic(). A rollback can't remove attachments
+    already written to storage, so if the import raises (say, an unreadable
+    line after the first batch) the files it stored are deleted here.
+    """
+    created = skipped = 0
+    batch = []
+    stored = []
+    try:
+        for record in records:
+            try:
+                batch.append((_build_note(user, record), record))
+            except ValueError:
+                skipped += 1
+                continue
+            if len(batch) >= batch_size:
+                created += _save_batch(user, batch, stored)
+                batch = []
+        if batch:
+            created += _save_batch(user, batch, stored)
+    except Exception:
+        for name in stored:
+            default_storage.delete(name)
+        raise
+    return created, skipped
@@ -0,0 +1,33 @@
+def apply_edits(text, edits):
+    """
+    Apply a list of splice edits to text and return the result.
+    
+    Each edit is {"start": int, "end": int, "text": str}: replace text[start:end]
+    with the given string. Offsets are Unicode code points into the *original*
+    text, and edits must not overlap. Raises ValueError for anything malformed.
+    """
+    if not isinstance(edits, list):
+        raise ValueError('changes must be a list')
+    
+    spans = []
+    for edit in edits:
+        if not isinstance(edit, dict):
+            raise ValueError('each change must be an object')
+        start, end, insert = edit.get('start'), edit.get('end'), edit.get('text', '')
+        if type(start) is not int or type(end) is not int or not isinstance(insert, str):
+            raise ValueError('each change needs integer start/end and string text')
+        if not 0 <= start <= end <= len(text):
+            raise ValueError(f'change {start}:{end} is outside the note content')
+        spans.append((start, end, insert))
+    
+    spans.sort(key=lambda span: (span[0], span[1]))
+    pieces = []
+    position = 0
+    for start, end, insert in spans:
+        if start < position:
+            raise ValueError('changes must not overlap')
+        pieces.append(text[position:start])
+        pieces.append(insert)
+        position = end
+    pieces.append(text[position:])
+    return ''.join(pieces)
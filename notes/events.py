@@ -0,0 +1,97 @@
+import asyncio
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def note_channel(note_id):
+    """Broker channel name for change notifications about one note"""
+    return f'note-{note_id}'
+
+
+class Subscription:
+    """
+    A single listener on a channel. Messages are handed over from whichever
+    thread published them onto the subscriber's own event loop.
+    """
+    def __init__(self, backend, channel):
+        self.backend = backend
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def deliver(self, message):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, message)
+
+    async def get(self, timeout=None):
+        """Wait for the next message; returns None if the timeout expires"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.backend.unsubscribe(self)
+
+
+class BaseEventBackend:
+    """
+    Interface for note event fan-out. Swap implementations with the
+    NOTES_EVENT_BACKEND setting (e.g. a Redis or Postgres LISTEN/NOTIFY
+    backend when running more than one server process).
+    """
+    def publish(self, channel, message):
+        raise NotImplementedError
+
+    def subscribe(self, channel):
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+
+class InProcessEventBackend(BaseEventBackend):
+    """
+    Fans messages out to subscribers in the current process only.
+    Fine for a single worker; multi-worker deployments need a shared backend.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.deliver(message)
+            except RuntimeError:
+                # The subscriber's event loop has gone away
+                self.unsubscribe(subscription)
+
+    def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+
+@lru_cache(maxsize=None)
+def get_event_backend():
+    """Return the configured event backend (one instance per process)"""
+    return import_string(settings.NOTES_EVENT_BACKEND)()
+
+
+def publish_note_event(note_id, event, **data):
+    """Notify everyone listening on a note that it changed"""
+    get_event_backend().publish(note_channel(note_id), {'event': event, 'note': note_id, **data})
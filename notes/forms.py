@@ -1,8 +1,25 @@
 from django import forms
-from .models import Note
+from django.core.files.uploadedfile import UploadedFile
+from django.template.defaultfilters import filesizeformat
+from .models import Note, Notebook
 
 class NoteForm(forms.ModelForm):
     """Form for creating/editing notes"""
+    # Version the edit was based on, checked on save to catch edits from another device
+    version = forms.IntegerField(widget=forms.HiddenInput, required=False)
+    notebook_name = forms.CharField(
+        max_length=100,
+        required=False,
+        label='Notebook',
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Notebook (optional)', 'list': 'notebook-options'})
+    )
+    tag_names = forms.CharField(
+        max_length=500,
+        required=False,
+        label='Tags',
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Comma-separated tags, e.g. work, ideas'})
+    )
+    
     class Meta:
         model = Note
         fields = ['title', 'content', 'media_file', 'is_pinned']
@@ -16,15 +33,67 @@ class NoteForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         self.user = kwargs.pop('user', None)
         super().__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.fields['version'].initial = self.instance.version
+            if self.instance.notebook_id:
+                self.fields['notebook_name'].initial = self.instance.notebook.name
+            self.fields['tag_names'].initial = ', '.join(self.instance.tags.values_list('name', flat=True))
         
         # Disable media upload for non-premium users
-        if self.user and not self.user.is_premium:
+        if self.user and not self.user.has_premium:
             self.fields['media_file'].disabled = True
             self.fields['media_file'].help_text = "Upgrade to Premium (Ksh 87) to upload media"
 
+    def clean_media_file(self):
+        media = self.cleaned_data.get('media_file')
+        if self.user and isinstance(media, UploadedFile):
+            # A replaced attachment frees its space
+            available = self.user.storage_available + (self.instance.media_size if self.instance.pk else 0)
+            if media.size > available:
+                raise forms.ValidationError(
+                    f'Not enough storage left for this file ({filesizeformat(available)} available).'
+                )
+        return media
+    
+    def clean_notebook_name(self):
+        return self.cleaned_data['notebook_name'].strip()
+    
+    def clean_tag_names(self):
+        names = self.cleaned_data['tag_names'].split(',')
+        return sorted({name.strip().lower()[:50] for name in names if name.strip()})
+    
+    @property
+    def changed_model_fields(self):
+        """Changed Note columns, for save(update_fields=...); tags are saved separately"""
+        columns = {'notebook_name': 'notebook'}
+        return [columns.get(name, name) for name in self.changed_data if name not in ('version', 'tag_names')]
+    
+    def save(self, commit=True):
+        note = super().save(commit=False)
+        if 'notebook_name' in self.changed_data:
+            name = self.cleaned_data['notebook_name']
+            note.notebook = Notebook.objects.get_or_create(owner=self.user, name=name)[0] if name else None
+        if commit:
+            note.save()
+            self.save_m2m()
+            self.save_tags(note)
+        return note
+    
+    def save_tags(self, note):
+        """Apply the tag field to a saved note (only if it changed)"""
+        if 'tag_names' in self.changed_data:
+            note.set_tags(self.cleaned_data['tag_names'])
+
 class ShareNoteForm(forms.Form):
     """Form for sharing notes with other users (premium feature)"""
     username = forms.CharField(
         max_length=150,
         widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Username to share with'})
-    )
\ No newline at end of file
+    )
+
+class ImportNotesForm(forms.Form):
+    """Upload form for bulk note import"""
+    archive = forms.FileField(
+        help_text="A Kitabu export (.zip or .jsonl), a .json file, or Markdown (.md) notes",
+        widget=forms.FileInput(attrs={'class': 'form-control', 'accept': '.zip,.json,.jsonl,.md,.markdown,.txt'})
+    )
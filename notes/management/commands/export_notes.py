@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import CustomUser
+from notes.archive import export_jsonl, export_zip
+
+
+class Command(BaseCommand):
+    help = "Export a user's notes to a .zip (with attachments) or .jsonl file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('path', help='Output file; a .jsonl suffix writes JSON lines without attachments')
+
+    def handle(self, *args, **options):
+        try:
+            user = CustomUser.objects.get(username=options['username'])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"User \"{options['username']}\" not found.")
+
+        path = options['path']
+        if path.endswith('.jsonl'):
+            with open(path, 'w', encoding='utf-8') as output:
+                output.writelines(export_jsonl(user))
+        else:
+            with open(path, 'wb') as output:
+                for chunk in export_zip(user):
+                    output.write(chunk)
+
+        self.stdout.write(self.style.SUCCESS(f'Exported notes for {user.username} to {path}.'))
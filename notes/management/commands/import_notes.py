@@ -0,0 +1,31 @@
+import zipfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from accounts.models import CustomUser
+from notes.archive import IMPORT_BATCH_SIZE, import_notes, parse_archive
+
+
+class Command(BaseCommand):
+    """Bulk-import an archive for a user; handy for archives too big to upload"""
+    help = 'Import notes for a user from a .zip, .json, .jsonl or .md file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('path')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = CustomUser.objects.get(username=options['username'])
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"User \"{options['username']}\" not found.")
+
+        try:
+            with open(options['path'], 'rb') as archive, transaction.atomic():
+                created, skipped = import_notes(user, parse_archive(archive), batch_size=options['batch_size'])
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            raise CommandError(f'Could not import {options["path"]}: {e}')
+
+        self.stdout.write(self.style.SUCCESS(f'Imported {created} notes for {user.username} ({skipped} skipped).'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='version',
+            field=models.PositiveIntegerField(default=1, help_text='Incremented on every save; used to detect conflicting edits'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_changes(apps, schema_editor):
+    """Seed the log with every existing note so first syncs see the whole library"""
+    Note = apps.get_model('notes', 'Note')
+    NoteChange = apps.get_model('notes', 'NoteChange')
+    changes = [
+        NoteChange(user_id=author_id, note_id=note_id, action='upsert')
+        for note_id, author_id in Note.objects.values_list('id', 'author_id').iterator()
+    ]
+    changes += [
+        NoteChange(user_id=share.customuser_id, note_id=share.note_id, action='upsert')
+        for share in Note.shared_with.through.objects.iterator()
+    ]
+    NoteChange.objects.bulk_create(changes, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0003_noterevision'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoteChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('note_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('upsert', 'Created or updated'), ('delete', 'Deleted or unshared')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='note_changes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'id'], name='notes_notec_user_id_3a8a20_idx'), models.Index(fields=['user', 'note_id'], name='notes_notec_user_id_915c18_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_changes, migrations.RunPython.noop),
+    ]
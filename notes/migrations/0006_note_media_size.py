@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-19 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notes', '0005_tags_and_notebooks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='note',
+            name='media_size',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+from functools import partial
+from django.db import models, transaction
+from django.db.models import F
 from django.conf import settings
 from django.core.validators import FileExtensionValidator
 import os
@@ -7,6 +9,56 @@ def note_media_path(instance, filename):
     """Generate file path for note media uploads"""
     return f'notes/{instance.author.username}/{filename}'
 
+class NoteVersionConflict(Exception):
+    """The note changed since the version a client based its edit on"""
+    def __init__(self, current_version):
+        super().__init__(f'Note is now at version {current_version}')
+        self.current_version = current_version
+
+class Notebook(models.Model):
+    """A named collection of a user's notes"""
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='notebooks'
+    )
+    name = models.CharField(max_length=100)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'name'], name='unique_notebook_name_per_owner'),
+        ]
+    
+    def __str__(self):
+        return self.name
+
+class Tag(models.Model):
+    """
+    A label on a user's notes. note_count is maintained incrementally by
+    signal handlers (see notes/signals.py) so tag lists never count rows.
+    """
+    owner = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='tags'
+    )
+    name = models.CharField(max_length=50)
+    note_count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'name'], name='unique_tag_name_per_owner'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', '-note_count']),
+        ]
+    
+    def __str__(self):
+        return self.name
+
 class Note(models.Model):
     """
     Core note model. Free users can create text notes.
@@ -32,6 +84,7 @@ class Note(models.Model):
         ],
         help_text="Premium feature: Upload images or documents"
     )
+    media_size = models.PositiveBigIntegerField(default=0)  # bytes, counted in the author's storage_used
     
     # Sharing (premium feature)
     shared_with = models.ManyToManyField(
@@ -41,28 +94,208 @@ class Note(models.Model):
         help_text="Premium feature: Share notes with other users"
     )
     
+    # Organisation
+    notebook = models.ForeignKey(
+        Notebook,
+        on_delete=models.SET_NULL,
+        related_name='notes',
+        null=True,
+        blank=True
+    )
+    tags = models.ManyToManyField(Tag, through='NoteTag', related_name='notes', blank=True)
+    
     # Metadata
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_pinned = models.BooleanField(default=False)
+    version = models.PositiveIntegerField(
+        default=1,
+        help_text="Incremented on every save; used to detect conflicting edits"
+    )
     
     class Meta:
         ordering = ['-is_pinned', '-updated_at']
         indexes = [
             models.Index(fields=['-created_at']),
             models.Index(fields=['author', '-updated_at']),
+            models.Index(fields=['notebook', '-updated_at']),
         ]
     
     def __str__(self):
         return f"{self.title} by {self.author.username}"
     
+    # (name, size) of the attachment as stored, or None if it wasn't loaded
+    _stored_media = ('', 0)
+    
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        note = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, values))
+        if 'media_file' in loaded and 'media_size' in loaded:
+            note._stored_media = (loaded['media_file'] or '', loaded['media_size'])
+        else:
+            note._stored_media = None
+        return note
+    
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using, fields, from_queryset)
+        if fields is None or 'media_file' in fields:
+            self._stored_media = None  # re-read if the attachment is saved later
+    
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        media_size = None
+        if update_fields is None or 'media_file' in update_fields:
+            media_size = self._changed_media_size()
+        if media_size is None:
+            self._save_version(*args, **kwargs)
+            return
+        
+        stored_name, stored_size = self._stored_media
+        with transaction.atomic():
+            # Reserve the space first, so an upload over quota is never written to storage
+            self.author.adjust_storage(media_size - stored_size)
+            self.media_size = media_size
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'media_size'}
+            self._save_version(*args, **kwargs)
+        self._stored_media = (self.media_file.name if self.media_file else '', media_size)
+        if stored_name:
+            # The replaced file goes once nothing can roll back to it
+            transaction.on_commit(partial(self.media_file.storage.delete, stored_name))
+    
+    def _save_version(self, *args, **kwargs):
+        # Every update bumps the version so other devices can detect stale edits
+        if not self._state.adding:
+            self.version += 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+    
+    def _changed_media_size(self):
+        """Size of the attachment if it changed since the note was loaded, else None"""
+        if 'media_file' not in self.__dict__:
+            return None  # deferred and never assigned
+        if self._stored_media is None:
+            name, size = Note.objects.filter(pk=self.pk).values_list('media_file', 'media_size').get()
+            self._stored_media = (name or '', size)
+        media = self.media_file
+        if media and media._committed and media.name == self._stored_media[0]:
+            return None
+        if not media and not self._stored_media[0]:
+            return None
+        return media.size if media else 0
+    
+    def set_tags(self, names):
+        """Replace the note's tags with the given names, creating any the author doesn't have yet"""
+        names = set(names)
+        existing = set(Tag.objects.filter(owner_id=self.author_id, name__in=names).values_list('name', flat=True))
+        Tag.objects.bulk_create(
+            [Tag(owner_id=self.author_id, name=name) for name in names - existing],
+            ignore_conflicts=True
+        )
+        tags = Tag.objects.filter(owner_id=self.author_id, name__in=names)
+        self.tags.set(tags, through_defaults={'updated_at': self.updated_at})
+    
+    def lock_version(self, expected_version):
+        """
+        Lock this note's row if it is still at expected_version, otherwise raise
+        NoteVersionConflict. Must be called inside transaction.atomic().
+        A no-op UPDATE is used because it takes the row lock on every backend,
+        where select_for_update() is ignored on SQLite.
+        """
+        claimed = Note.objects.filter(pk=self.pk, version=expected_version).update(version=F('version'))
+        if not claimed:
+            current = Note.objects.filter(pk=self.pk).values_list('version', flat=True).first()
+            raise NoteVersionConflict(current)
+        self.version = expected_version
+    
     def can_user_edit(self, user):
         """Check if user can edit this note"""
         return self.author == user or user in self.shared_with.all()
     
+    async def acan_user_edit(self, user):
+        """Async variant of can_user_edit for async views"""
+        if self.author_id == user.pk:
+            return True
+        return await self.shared_with.filter(pk=user.pk).aexists()
+    
     @property
     def media_filename(self):
         """Get just the filename without path"""
         if self.media_file:
             return os.path.basename(self.media_file.name)
-        return None
\ No newline at end of file
+        return None
+
+class NoteTag(models.Model):
+    """
+    Note <-> Tag link. Carries a copy of the note's updated_at so listing a
+    tag newest-first is a single index range scan on (tag, -updated_at).
+    """
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='note_tags')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='note_tags')
+    updated_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['note', 'tag'], name='unique_note_tag'),
+        ]
+        indexes = [
+            models.Index(fields=['tag', '-updated_at']),
+        ]
+
+class NoteRevision(models.Model):
+    """
+    One saved state of a note's content. Most rows hold a compressed delta
+    against the previous revision; every few revisions (and the oldest one
+    kept) is a full snapshot so any version can be rebuilt from a short chain.
+    See notes/revisions.py.
+    """
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='revisions')
+    version = models.PositiveIntegerField()
+    is_snapshot = models.BooleanField(default=False)
+    data = models.BinaryField()  # zlib-compressed content or delta
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-version']
+        constraints = [
+            models.UniqueConstraint(fields=['note', 'version'], name='unique_note_revision_version'),
+        ]
+    
+    def __str__(self):
+        return f"{self.note_id} v{self.version}{' (snapshot)' if self.is_snapshot else ''}"
+
+
+class NoteChange(models.Model):
+    """
+    Per-user change log used by the sync API. Each row says "note X changed
+    (or is gone) for user Y"; the auto-increment id doubles as the sync
+    cursor. Only the latest row per (user, note) is kept, so the log is
+    bounded by the notes a user can see plus their tombstones.
+    """
+    UPSERT = 'upsert'
+    DELETE = 'delete'
+    ACTION_CHOICES = [
+        (UPSERT, 'Created or updated'),
+        (DELETE, 'Deleted or unshared'),
+    ]
+    
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='note_changes'
+    )
+    note_id = models.BigIntegerField()  # not a FK: tombstones outlive the note
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id']),
+            models.Index(fields=['user', 'note_id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.action} note {self.note_id} for user {self.user_id}"
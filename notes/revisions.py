@@ -0,0 +1,152 @@
+"""
+Revision history for note content.
+
+Each content save is stored as a zlib-compressed line delta against the
+previous revision, so storage grows with the size of the edits rather than
+note size x number of edits. A full snapshot is written every
+NOTES_REVISION_SNAPSHOT_INTERVAL revisions to keep reconstruction cheap, and
+the oldest retained revision is always a snapshot so pruning never breaks a
+delta chain.
+"""
+import difflib
+import json
+import zlib
+
+from django.conf import settings
+from django.db.models import Max
+
+from accounts.entitlements import has_premium
+
+from .models import NoteRevision
+
+# Delta ops: [COPY, n] keeps n lines, [INSERT, text] adds text, [SKIP, n] drops n lines
+COPY, INSERT, SKIP = 0, 1, 2
+
+
+def _compress(value):
+    return zlib.compress(value.encode('utf-8'))
+
+
+def _decompress(data):
+    return zlib.decompress(bytes(data)).decode('utf-8')
+
+
+def make_delta(old, new):
+    """Encode the line-level changes turning old into new"""
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append([COPY, i2 - i1])
+            continue
+        if i2 > i1:
+            ops.append([SKIP, i2 - i1])
+        if j2 > j1:
+            ops.append([INSERT, ''.join(new_lines[j1:j2])])
+    return json.dumps(ops, separators=(',', ':'))
+
+
+def apply_delta(old, delta):
+    """Rebuild new content from old content and a make_delta() result"""
+    old_lines = old.splitlines(keepends=True)
+    position = 0
+    pieces = []
+    for op, value in json.loads(delta):
+        if op == COPY:
+            pieces.extend(old_lines[position:position + value])
+            position += value
+        elif op == SKIP:
+            position += value
+        else:
+            pieces.append(value)
+    return ''.join(pieces)
+
+
+def _rebuild(note_id, version):
+    """
+    Return (content, chain_length) for a recorded revision, where chain_length
+    counts the snapshot plus the deltas applied on top of it. Returns
+    (None, 0) if the revision doesn't exist (never recorded or pruned).
+    """
+    snapshot_version = NoteRevision.objects.filter(
+        note_id=note_id, is_snapshot=True, version__lte=version
+    ).aggregate(latest=Max('version'))['latest']
+    if snapshot_version is None:
+        return None, 0
+    
+    chain = list(NoteRevision.objects.filter(
+        note_id=note_id, version__gte=snapshot_version, version__lte=version
+    ).order_by('version').values_list('version', 'is_snapshot', 'data'))
+    if chain[-1][0] != version:
+        return None, 0
+    
+    content = None
+    for _, is_snapshot, data in chain:
+        content = _decompress(data) if is_snapshot else apply_delta(content, _decompress(data))
+    return content, len(chain)
+
+
+def content_at(note_id, version):
+    """Return the note content as of a recorded revision, or None if it isn't stored"""
+    return _rebuild(note_id, version)[0]
+
+
+def retention_limit(user_id):
+    """How many revisions are kept per note for this user's tier"""
+    if has_premium(user_id):
+        return settings.NOTES_REVISIONS_PREMIUM
+    return settings.NOTES_REVISIONS_FREE
+
+
+def record_revision(note):
+    """
+    Store the note's current content as a new revision. Called from the
+    post_save signal, inside the same transaction as the save.
+    """
+    latest_version = NoteRevision.objects.filter(note_id=note.pk).aggregate(latest=Max('version'))['latest']
+    if latest_version is not None and latest_version >= note.version:
+        return None
+    
+    revision = NoteRevision(note_id=note.pk, version=note.version)
+    previous, chain_length = _rebuild(note.pk, latest_version) if latest_version is not None else (None, 0)
+    if previous is None:
+        revision.is_snapshot = True
+    elif previous == note.content:
+        return None
+    else:
+        revision.is_snapshot = chain_length >= settings.NOTES_REVISION_SNAPSHOT_INTERVAL
+    
+    revision.data = _compress(note.content if revision.is_snapshot else make_delta(previous, note.content))
+    revision.save()
+    prune_revisions(note.pk, retention_limit(note.author_id))
+    return revision
+
+
+def record_initial_revisions(notes):
+    """Snapshot revisions for freshly bulk-created notes (which skip post_save)"""
+    NoteRevision.objects.bulk_create([
+        NoteRevision(note_id=note.pk, version=note.version, is_snapshot=True, data=_compress(note.content))
+        for note in notes
+    ])
+
+
+def prune_revisions(note_id, keep):
+    """
+    Drop all but the newest `keep` revisions of a note. The oldest survivor
+    is rewritten as a snapshot first so it can still be reconstructed.
+    """
+    versions = list(NoteRevision.objects.filter(note_id=note_id).values_list('version', flat=True)[:keep + 1])
+    if len(versions) <= keep:
+        return 0
+    
+    oldest_kept = versions[keep - 1]
+    first_kept = NoteRevision.objects.get(note_id=note_id, version=oldest_kept)
+    if not first_kept.is_snapshot:
+        first_kept.data = _compress(content_at(note_id, oldest_kept))
+        first_kept.is_snapshot = True
+        first_kept.save(update_fields=['data', 'is_snapshot'])
+    
+    deleted, _ = NoteRevision.objects.filter(note_id=note_id, version__lt=oldest_kept).delete()
+    return deleted
@@ -0,0 +1,141 @@
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .events import publish_note_event
+from .models import Note, NoteChange, NoteTag, Tag
+from .revisions import record_revision
+from .sync import audience, record_changes, record_sharing_changes
+
+
+@receiver(post_save, sender=Note)
+def note_saved(sender, instance, created, **kwargs):
+    """Push a change notification once the save is committed"""
+    if created:
+        return
+    transaction.on_commit(partial(
+        publish_note_event, instance.pk, 'changed', updated_at=instance.updated_at.isoformat()
+    ))
+
+
+@receiver(post_save, sender=Note)
+def note_content_saved(sender, instance, update_fields, raw, **kwargs):
+    """Record content history in the same transaction as the save"""
+    if raw or (update_fields is not None and 'content' not in update_fields):
+        return
+    record_revision(instance)
+
+
+@receiver(post_save, sender=Note)
+def note_sync_saved(sender, instance, created, raw, **kwargs):
+    """Log the save for everyone who syncs this note"""
+    if raw:
+        return
+    users = [instance.author_id] if created else audience(instance)
+    record_changes(NoteChange.UPSERT, instance.pk, users)
+
+
+@receiver(post_save, sender=Note)
+def note_tags_touched(sender, instance, created, raw, **kwargs):
+    """Keep the updated_at copy on tag links in step, for index-ordered tag listings"""
+    if created or raw:
+        return
+    NoteTag.objects.filter(note_id=instance.pk).update(updated_at=instance.updated_at)
+
+
+@receiver(pre_delete, sender=Note)
+def note_tags_deleting(sender, instance, **kwargs):
+    # Tag links are removed by the cascade without m2m signals
+    Tag.objects.filter(note_tags__note=instance).update(note_count=F('note_count') - 1)
+
+
+@receiver(pre_delete, sender=Note)
+def note_sync_deleting(sender, instance, **kwargs):
+    # Written before the delete so sharees are still known; if the author is
+    # being deleted too, the cascade removes their tombstones along with them.
+    record_changes(NoteChange.DELETE, instance.pk, audience(instance))
+
+
+@receiver(post_delete, sender=Note)
+def note_deleted(sender, instance, **kwargs):
+    transaction.on_commit(partial(publish_note_event, instance.pk, 'deleted'))
+
+
+@receiver(post_delete, sender=Note)
+def note_media_deleted(sender, instance, **kwargs):
+    """Release the attachment's bytes from the author's usage and remove the file after commit"""
+    if not instance.media_file:
+        return
+    get_user_model().objects.filter(pk=instance.author_id).update(
+        storage_used=Greatest(F('storage_used') - instance.media_size, Value(0))
+    )
+    transaction.on_commit(partial(instance.media_file.storage.delete, instance.media_file.name))
+
+
+@receiver(m2m_changed, sender=Note.shared_with.through)
+def note_sharing_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Mark shared notes as modified, log the change for sync and notify listeners"""
+    if action == 'pre_clear':
+        # clear() doesn't report what it removed, so note it beforehand
+        related = instance.shared_notes if reverse else instance.shared_with
+        instance._cleared_pks = set(related.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_pks', None)
+    if not pk_set:
+        return  # add()/remove() of relations that already (didn't) exist
+    
+    if reverse:
+        # Changed from the user side (user.shared_notes.add(...)): pk_set holds note ids
+        note_ids, users = sorted(pk_set), [instance.pk]
+    else:
+        note_ids, users = [instance.pk], sorted(pk_set)
+    shared = action == 'post_add'
+    
+    # Sharing is a change to the note as far as caches and sync clients are concerned
+    now = timezone.now()
+    Note.objects.filter(pk__in=note_ids).update(updated_at=now)
+    NoteTag.objects.filter(note_id__in=note_ids).update(updated_at=now)
+    record_sharing_changes(note_ids, users, shared)
+    
+    event = 'shared' if shared else 'unshared'
+    for note_id in note_ids:
+        transaction.on_commit(partial(publish_note_event, note_id, event, users=users))
+
+
+@receiver(m2m_changed, sender=Note.tags.through)
+def note_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Maintain Tag.note_count incrementally and mark re-tagged notes as modified"""
+    if action == 'pre_clear':
+        related = instance.notes if reverse else instance.tags
+        instance._cleared_tag_pks = set(related.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action == 'post_clear':
+        pk_set = instance.__dict__.pop('_cleared_tag_pks', None)
+    if not pk_set:
+        return
+    
+    step = 1 if action == 'post_add' else -1
+    if reverse:
+        # tag.notes.add(...): pk_set holds note ids
+        Tag.objects.filter(pk=instance.pk).update(note_count=F('note_count') + step * len(pk_set))
+        note_ids = pk_set
+    else:
+        Tag.objects.filter(pk__in=pk_set).update(note_count=F('note_count') + step)
+        note_ids = [instance.pk]
+    
+    now = timezone.now()
+    Note.objects.filter(pk__in=note_ids).update(updated_at=now)
+    NoteTag.objects.filter(note_id__in=note_ids).update(updated_at=now)
+    for note in Note.objects.filter(pk__in=note_ids).only('id', 'author_id'):
+        record_changes(NoteChange.UPSERT, note.pk, audience(note))
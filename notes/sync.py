@@ -0,0 +1,64 @@
+"""
+Change-log bookkeeping for the offline sync API.
+
+Signal handlers call record_changes() whenever a note becomes newer or
+disappears for a set of users. Older log rows for the same (user, note) are
+replaced so a reconnecting client downloads each changed note once, no
+matter how many times it was edited while the client was offline.
+
+The log id is the client's cursor, but ids are assigned at INSERT and only
+become visible at COMMIT. If two transactions wrote to one user's log and
+committed out of order, a client could be handed a cursor past a change
+that wasn't visible yet and never receive it. Writers therefore lock the
+users' rows first (lock_change_logs), so each user's log is appended to by
+one transaction at a time and its ids become visible in order. SQLite
+ignores the lock but already serialises all writers.
+"""
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from .models import Note, NoteChange
+
+
+def lock_change_logs(user_ids):
+    """
+    Serialise writes to these users' change logs until the transaction
+    ends. Must be called inside transaction.atomic(); rows are locked in id
+    order so concurrent writers can't deadlock on each other.
+    """
+    list(
+        get_user_model().objects.select_for_update()
+        .filter(pk__in=user_ids).order_by('pk').values_list('pk', flat=True)
+    )
+
+
+def record_changes(action, note_id, user_ids):
+    """Log `action` on one note for each of the given users"""
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    with transaction.atomic():
+        lock_change_logs(user_ids)
+        NoteChange.objects.filter(user_id__in=user_ids, note_id=note_id).delete()
+        NoteChange.objects.bulk_create([
+            NoteChange(user_id=user_id, note_id=note_id, action=action) for user_id in user_ids
+        ])
+
+
+def audience(note):
+    """Everyone who currently sees the note: its author plus its sharees"""
+    return [note.author_id, *note.shared_with.values_list('id', flat=True)]
+
+
+def record_sharing_changes(note_ids, user_ids, shared):
+    """
+    Log a sharing change. The affected users gain (upsert) or lose (tombstone)
+    the notes; the authors get an upsert because the sharee list changed.
+    """
+    notes = list(Note.objects.filter(pk__in=note_ids).values_list('id', 'author_id'))
+    with transaction.atomic():
+        # Take every lock up front, in order, rather than author then sharees
+        lock_change_logs({author_id for _, author_id in notes} | set(user_ids))
+        for note_id, author_id in notes:
+            record_changes(NoteChange.UPSERT, note_id, [author_id])
+            record_changes(NoteChange.UPSERT if shared else NoteChange.DELETE, note_id, user_ids)
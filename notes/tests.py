@@ -1,3 +1,755 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import tempfile
+import zipfile
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from unittest import mock, skipIf
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, connections, transaction
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.entitlements import has_premium
+from accounts.models import CustomUser
+from kitabu_project.db_router import (
+    PIN_COOKIE, REPLICA, ReplicaRouter, is_pinned, read_from_replica,
+)
+from kitabu_project.middleware import brotli
+
+from .archive import export_jsonl, import_notes, parse_archive
+from .events import InProcessEventBackend, note_channel
+from .models import Note, Notebook, NoteChange, NoteRevision, Tag, note_media_path
+from .revisions import apply_delta, content_at, make_delta
+from .sync import record_changes
+
+
+class ReplicaRouterTests(SimpleTestCase):
+
+    def test_reads_use_primary_outside_replica_block(self):
+        self.assertEqual(ReplicaRouter().db_for_read(Note), 'default')
+
+    def test_reads_use_replica_inside_replica_block(self):
+        with read_from_replica():
+            self.assertEqual(ReplicaRouter().db_for_read(Note), REPLICA)
+        self.assertEqual(ReplicaRouter().db_for_read(Note), 'default')
+
+    def test_writes_always_use_primary(self):
+        with read_from_replica():
+            self.assertEqual(ReplicaRouter().db_for_write(Note), 'default')
+
+    def test_write_requests_and_pin_cookie_pin_to_primary(self):
+        factory = RequestFactory()
+        self.assertFalse(is_pinned(factory.get('/')))
+        self.assertTrue(is_pinned(factory.post('/')))
+        pinned = factory.get('/')
+        pinned.COOKIES[PIN_COOKIE] = '1'
+        self.assertTrue(is_pinned(pinned))
+
+
+class ReplicaReadTests(TestCase):
+    """
+    The test runner gives 'replica' its own empty database rather than a copy
+    of 'default', so rows written to the primary stand in for replication lag:
+    a view that reads from the replica can't see them.
+    """
+    databases = {'default', REPLICA}
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='reader', password='pw', is_staff=True)
+        self.client.force_login(self.user)
+        self.note = Note.objects.create(author=self.user, title='Fresh note', content='Just written')
+
+    def get(self, name):
+        return self.client.get(reverse(name), secure=True)
+
+    def test_entitlements_are_read_from_primary(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(is_premium=True, premium_activated_at=timezone.now())
+        cache.clear()
+        with read_from_replica():
+            self.assertTrue(has_premium(self.user.pk))
+
+    def test_note_list_reads_from_replica(self):
+        with CaptureQueriesContext(connections[REPLICA]) as replica_queries:
+            response = self.get('notes:note_list')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(replica_queries.captured_queries)
+        self.assertNotContains(response, 'Fresh note')
+
+    def test_profile_counts_read_from_replica(self):
+        response = self.get('accounts:profile')
+        self.assertContains(response, '0 written')
+
+    def test_staff_dashboard_reads_from_replica(self):
+        with CaptureQueriesContext(connections[REPLICA]) as replica_queries:
+            response = self.get('admin_dashboard')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(replica_queries.captured_queries)
+
+    def test_write_pins_reads_to_primary(self):
+        response = self.client.post(reverse('notes:note_create'), {
+            'title': 'Saved just now', 'content': 'Body', 'notebook_name': '', 'tag_names': '',
+        }, secure=True)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+
+        with CaptureQueriesContext(connections[REPLICA]) as replica_queries:
+            response = self.get('notes:note_list')
+        self.assertFalse(replica_queries.captured_queries)
+        self.assertContains(response, 'Saved just now')
+        self.assertContains(response, 'Fresh note')
+
+    def test_reads_return_to_replica_when_pin_expires(self):
+        self.client.cookies[PIN_COOKIE] = '1'
+        self.assertContains(self.get('notes:note_list'), 'Fresh note')
+        del self.client.cookies[PIN_COOKIE]
+        self.assertNotContains(self.get('notes:note_list'), 'Fresh note')
+
+
+# note_list and note_detail are async views: check them through the sync
+# test client (as under WSGI) and the async one (as under ASGI)
+class AsyncNoteViewTests(TestCase):
+    databases = {'default', REPLICA}
+
+    def setUp(self):
+        self.author = CustomUser.objects.create_user(username='author', password='pw')
+        self.reader = CustomUser.objects.create_user(username='reader', password='pw')
+        self.note = Note.objects.create(author=self.author, title='Shared note', content='Body')
+        self.note.shared_with.add(self.reader)
+        self.detail_url = reverse('notes:note_detail', args=[self.note.pk])
+        for client in (self.client, self.async_client):
+            client.cookies[PIN_COOKIE] = '1'  # read the notes just written, not the empty replica
+
+    def test_note_list(self):
+        self.client.force_login(self.author)
+        self.assertContains(self.client.get(reverse('notes:note_list'), secure=True), 'Shared note')
+
+    async def test_note_list_under_asgi(self):
+        await self.async_client.aforce_login(self.reader)
+        response = await self.async_client.get(reverse('notes:note_list'), secure=True)
+        self.assertEqual([note.title for note in response.context['shared_notes']], ['Shared note'])
+
+    def test_note_detail(self):
+        self.client.force_login(self.reader)
+        self.assertContains(self.client.get(self.detail_url, secure=True), 'Body')
+        self.client.force_login(CustomUser.objects.create_user(username='stranger', password='pw'))
+        self.assertEqual(self.client.get(self.detail_url, secure=True).status_code, 403)
+
+    async def test_note_detail_under_asgi(self):
+        await self.async_client.aforce_login(self.author)
+        self.assertContains(await self.async_client.get(self.detail_url, secure=True), 'Body')
+        missing = await self.async_client.get(reverse('notes:note_detail', args=[self.note.pk + 1]), secure=True)
+        self.assertEqual(missing.status_code, 404)
+
+    async def test_login_is_required_under_asgi(self):
+        response = await self.async_client.get(self.detail_url, secure=True)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response.url.startswith(reverse(settings.LOGIN_URL)))
+
+
+class NoteSyncTests(TestCase):
+
+    def setUp(self):
+        self.author = CustomUser.objects.create_user(username='author', password='pw')
+        self.reader = CustomUser.objects.create_user(username='reader', password='pw')
+        self.note = Note.objects.create(author=self.author, title='Shared', content='Secret plans')
+        self.note.shared_with.add(self.reader)
+
+    def sync(self, user, cursor=0):
+        self.client.force_login(user)
+        response = self.client.get(reverse('notes_api:note_sync'), {'cursor': cursor}, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_shared_note_is_delivered(self):
+        data = self.sync(self.reader)
+        self.assertEqual([note['id'] for note in data['changed']], [self.note.pk])
+        self.assertEqual(data['deleted'], [])
+
+    def test_upsert_after_unshare_is_reported_as_deleted(self):
+        self.note.shared_with.remove(self.reader)
+        # An edit that read the audience before the unshare committed
+        # replaces the reader's tombstone with an upsert
+        record_changes(NoteChange.UPSERT, self.note.pk, [self.reader.pk])
+
+        data = self.sync(self.reader)
+        self.assertEqual(data['changed'], [])
+        self.assertEqual(data['deleted'], [self.note.pk])
+        self.assertNotIn('Secret plans', json.dumps(data))
+
+    def test_change_log_is_locked_before_new_cursors_are_allocated(self):
+        with CaptureQueriesContext(connection) as queries:
+            record_changes(NoteChange.UPSERT, self.note.pk, [self.author.pk, self.reader.pk])
+        statements = [query['sql'] for query in queries.captured_queries]
+        lock = next(i for i, sql in enumerate(statements) if 'FROM "accounts_customuser"' in sql)
+        insert = next(i for i, sql in enumerate(statements) if sql.startswith('INSERT INTO "notes_notechange"'))
+        self.assertLess(lock, insert)
+        if connection.features.has_select_for_update:
+            self.assertIn('FOR UPDATE', statements[lock])
+
+    def test_cursor_resumes_after_last_change(self):
+        first = self.sync(self.reader)
+        self.note.content = 'Revised plans'
+        self.note.save()
+        second = self.sync(self.reader, first['cursor'])
+        self.assertEqual([note['id'] for note in second['changed']], [self.note.pk])
+        self.assertGreater(second['cursor'], first['cursor'])
+        self.assertEqual(self.sync(self.reader, second['cursor'])['changed'], [])
+
+
+class EventBackendTests(SimpleTestCase):
+
+    async def test_published_messages_reach_subscribers_of_that_channel_only(self):
+        backend = InProcessEventBackend()
+        listener = backend.subscribe(note_channel(1))
+        bystander = backend.subscribe(note_channel(2))
+
+        backend.publish(note_channel(1), {'event': 'changed', 'note': 1})
+        self.assertEqual(await listener.get(timeout=1), {'event': 'changed', 'note': 1})
+        self.assertIsNone(await bystander.get(timeout=0.01))
+
+        listener.close()
+        bystander.close()
+        backend.publish(note_channel(1), {'event': 'changed', 'note': 1})
+        self.assertIsNone(await listener.get(timeout=0.01))
+        self.assertEqual(backend._subscribers, {})
+
+
+class NoteEventsTests(TestCase):
+
+    def setUp(self):
+        self.author = CustomUser.objects.create_user(username='author', password='pw')
+        self.note = Note.objects.create(author=self.author, title='Live', content='x')
+
+    def test_sync_worker_answers_204(self):
+        self.client.force_login(self.author)
+        response = self.client.get(reverse('notes:note_events', args=[self.note.pk]), secure=True)
+        self.assertEqual(response.status_code, 204)
+
+    def test_stream_is_limited_to_people_who_can_see_the_note(self):
+        self.client.force_login(CustomUser.objects.create_user(username='stranger', password='pw'))
+        response = self.client.get(reverse('notes:note_events', args=[self.note.pk]), secure=True)
+        self.assertEqual(response.status_code, 403)
+
+
+# The stream closes its database connections and publishes from on_commit,
+# so these tests need real commits rather than a wrapping test transaction
+class NoteEventStreamTests(TransactionTestCase):
+
+    def setUp(self):
+        self.author = CustomUser.objects.create_user(username='author', password='pw')
+        self.reader = CustomUser.objects.create_user(username='reader', password='pw')
+        self.note = Note.objects.create(author=self.author, title='Live', content='x')
+        self.note.shared_with.add(self.reader)
+
+    @asynccontextmanager
+    async def open_stream(self, user):
+        client = AsyncClient()
+        await client.aforce_login(user)
+        response = await client.get(reverse('notes:note_events', args=[self.note.pk]), secure=True)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = response.streaming_content
+        try:
+            self.assertEqual(await self.next_chunk(events), b'retry: 5000\n\n')  # subscribed from here on
+            yield events
+        finally:
+            await events.aclose()
+
+    async def next_chunk(self, events):
+        return await asyncio.wait_for(anext(events), timeout=5)
+
+    def edit(self):
+        self.note.content = 'Updated'
+        self.note.save()
+
+    async def test_save_is_pushed_as_changed(self):
+        async with self.open_stream(self.reader) as events:
+            await sync_to_async(self.edit)()
+            chunk = await self.next_chunk(events)
+        self.assertTrue(chunk.startswith(b'event: changed\n'), chunk)
+
+    async def test_unshare_revokes_and_ends_the_stream(self):
+        async with self.open_stream(self.reader) as events:
+            await sync_to_async(self.note.shared_with.remove)(self.reader)
+            chunk = await self.next_chunk(events)
+            self.assertTrue(chunk.startswith(b'event: revoked\n'), chunk)
+            with self.assertRaises(StopAsyncIteration):
+                await self.next_chunk(events)
+
+
+class ApiTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='mobile', password='pw')
+        self.note = Note.objects.create(author=self.user, title='Long note', content='Lorem ipsum ' * 50)
+        self.client.force_login(self.user)
+
+    def detail_url(self, note=None):
+        return reverse('notes_api:note_detail', args=[(note or self.note).pk])
+
+    def get_list(self, if_none_match=None, **params):
+        headers = {'HTTP_IF_NONE_MATCH': if_none_match} if if_none_match else {}
+        return self.client.get(reverse('notes_api:note_collection'), params, secure=True, **headers)
+
+    def patch(self, payload, **headers):
+        return self.client.patch(
+            self.detail_url(), json.dumps(payload), content_type='application/json', secure=True, **headers
+        )
+
+    def test_if_match_accepts_the_weak_tag_of_a_compressed_response(self):
+        response = self.client.get(self.detail_url(), HTTP_ACCEPT_ENCODING='br, gzip', secure=True)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"note-'), etag)
+
+        response = self.patch({'title': 'Renamed'}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'Renamed')
+
+        # The note moved on, so the old tag no longer matches
+        self.assertEqual(self.patch({'title': 'Again'}, HTTP_IF_MATCH=etag).status_code, 412)
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.title, 'Renamed')
+
+    def test_if_match_accepts_the_strong_tag(self):
+        etag = self.client.get(self.detail_url(), secure=True)['ETag']
+        self.assertTrue(etag.startswith('"note-'), etag)
+        self.assertEqual(self.patch({'title': 'Renamed'}, HTTP_IF_MATCH=etag).status_code, 200)
+
+
+    def test_fields_trim_the_response_and_the_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get_list(fields='id,title')
+        self.assertEqual(response.json()['results'], [{'id': self.note.pk, 'title': 'Long note'}])
+        note_selects = [query['sql'] for query in queries.captured_queries if 'FROM "notes_note"' in query['sql']]
+        self.assertTrue(note_selects)
+        self.assertFalse(any('"notes_note"."content"' in sql for sql in note_selects))
+
+        self.assertEqual(self.get_list(fields='id,secret').status_code, 400)
+        self.assertEqual(self.client.get(self.detail_url(), {'fields': 'secret'}, secure=True).status_code, 400)
+
+    def test_cursor_pages_through_every_note_once(self):
+        same_time = timezone.now() - timedelta(days=1)
+        for i in range(4):
+            note = Note.objects.create(author=self.user, title=f'Tied {i}', content='x')
+            Note.objects.filter(pk=note.pk).update(updated_at=same_time)  # ties fall back to id order
+        newest_first = Note.objects.filter(author=self.user).order_by('-updated_at', '-id')
+        expected = list(newest_first.values_list('pk', flat=True))
+
+        seen, cursor = [], None
+        while True:
+            params = {'fields': 'id', 'limit': 2, **({'cursor': cursor} if cursor else {})}
+            data = self.get_list(**params).json()
+            seen += [note['id'] for note in data['results']]
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+
+    def test_bad_cursor_and_limit_are_rejected(self):
+        bad = [{'cursor': 'not-a-cursor'}, {'cursor': 'NQ'}, {'limit': 0}, {'limit': 'ten'}, {'scope': 'everyone'}]
+        for params in bad:
+            response = self.get_list(**params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn('error', response.json())
+
+    def test_unchanged_list_comes_back_as_304(self):
+        etag = self.get_list()['ETag']
+        self.assertEqual(self.get_list(etag).status_code, 304)
+        # A different query is a different list
+        self.assertEqual(self.get_list(etag, fields='id').status_code, 200)
+
+        Note.objects.create(author=self.user, title='Another', content='x')
+        self.assertEqual(self.get_list(etag).status_code, 200)
+
+    def test_unchanged_note_comes_back_as_304(self):
+        response = self.client.get(self.detail_url(), secure=True)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.client.get(self.detail_url(), HTTP_IF_NONE_MATCH=etag, secure=True).status_code, 304)
+        self.assertEqual(
+            self.client.get(self.detail_url(), HTTP_IF_MODIFIED_SINCE=last_modified, secure=True).status_code, 304
+        )
+
+        Note.objects.filter(pk=self.note.pk).update(updated_at=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(self.client.get(self.detail_url(), HTTP_IF_NONE_MATCH=etag, secure=True).status_code, 200)
+
+    def test_patch_with_stale_version_is_rejected(self):
+        Note.objects.get(pk=self.note.pk).save()  # saved elsewhere: version 2
+        response = self.patch({'version': 1, 'title': 'Mine'})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['version'], 2)
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.title, 'Long note')
+
+    def test_sharing_requires_premium_but_unsharing_does_not(self):
+        friend = CustomUser.objects.create_user(username='friend', password='pw')
+        url = reverse('notes_api:note_share', args=[self.note.pk])
+        body = json.dumps({'username': 'friend'})
+
+        response = self.client.post(url, body, content_type='application/json', secure=True)
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(self.note.shared_with.exists())
+
+        CustomUser.objects.filter(pk=self.user.pk).update(is_premium=True, premium_activated_at=timezone.now())
+        cache.clear()
+        response = self.client.post(url, body, content_type='application/json', secure=True)
+        self.assertEqual(response.json()['shared_with'], ['friend'])
+
+        CustomUser.objects.filter(pk=self.user.pk).update(is_premium=False)
+        cache.clear()
+        response = self.client.delete(url, body, content_type='application/json', secure=True)
+        self.assertEqual(response.json()['shared_with'], [])
+        self.assertFalse(self.note.shared_with.filter(pk=friend.pk).exists())
+
+    @skipIf(brotli is None, 'Brotli is not installed')
+    def test_compression_prefers_brotli_then_gzip(self):
+        response = self.client.get(self.detail_url(), HTTP_ACCEPT_ENCODING='gzip, br', secure=True)
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(brotli.decompress(response.content))['id'], self.note.pk)
+
+        response = self.client.get(self.detail_url(), HTTP_ACCEPT_ENCODING='gzip', secure=True)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(json.loads(gzip.decompress(response.content))['id'], self.note.pk)
+
+        response = self.client.get(self.detail_url(), secure=True)
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_small_responses_and_pages_are_not_compressed(self):
+        small = self.client.get(self.detail_url(), {'fields': 'id'}, HTTP_ACCEPT_ENCODING='br', secure=True)
+        self.assertFalse(small.has_header('Content-Encoding'))
+        # HTML pages carry CSRF tokens, so they are never compressed
+        page = self.client.get(
+            reverse('notes:note_detail', args=[self.note.pk]), HTTP_ACCEPT_ENCODING='br, gzip', secure=True
+        )
+        self.assertFalse(page.has_header('Content-Encoding'))
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class LapsedPremiumEditTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(
+            username='lapsed', password='pw', is_premium=True,
+            premium_activated_at=timezone.now() - timedelta(days=400),
+        )
+        self.note = Note.objects.create(author=self.user, title='With file', content='Body')
+        # Attached while premium was active
+        self.media_name = default_storage.save('notes/report.pdf', ContentFile(b'%PDF' * 25))
+        Note.objects.filter(pk=self.note.pk).update(media_file=self.media_name, media_size=100)
+        self.client.force_login(self.user)
+
+    def test_note_with_existing_attachment_can_still_be_edited(self):
+        response = self.client.post(reverse('notes:note_edit', args=[self.note.pk]), {
+            'title': 'Renamed', 'content': 'Body', 'version': 1,
+            'notebook_name': '', 'tag_names': '',
+        }, secure=True)
+        self.assertRedirects(response, reverse('notes:note_detail', args=[self.note.pk]), fetch_redirect_response=False)
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.title, 'Renamed')
+        self.assertEqual(self.note.media_file.name, self.media_name)
+
+
+class NoteArchiveTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='archivist', password='pw')
+        self.other = CustomUser.objects.create_user(username='importer', password='pw')
+        self.created = timezone.now() - timedelta(days=90)
+        self.updated = timezone.now() - timedelta(days=30)
+        for title in ('First', 'Second'):
+            note = Note.objects.create(author=self.user, title=title, content=f'{title} body')
+            Note.objects.filter(pk=note.pk).update(created_at=self.created, updated_at=self.updated)
+
+    def test_round_trip_keeps_timestamps(self):
+        records = [json.loads(line) for line in export_jsonl(self.user)]
+        self.assertEqual(import_notes(self.other, records), (2, 0))
+
+        for note in Note.objects.filter(author=self.other):
+            self.assertEqual(note.created_at, self.created)
+            self.assertEqual(note.updated_at, self.updated)
+
+    def test_round_trip_keeps_tags_and_notebooks(self):
+        first = Note.objects.get(author=self.user, title='First')
+        first.notebook = Notebook.objects.create(owner=self.user, name='Work')
+        first.save()
+        first.set_tags(['ideas', 'todo'])
+        Note.objects.get(author=self.user, title='Second').set_tags(['ideas'])
+        # The importer already uses one of the tags
+        existing = Note.objects.create(author=self.other, title='Mine', content='x')
+        existing.set_tags(['ideas'])
+
+        import_notes(self.other, [json.loads(line) for line in export_jsonl(self.user)])
+
+        imported = Note.objects.get(author=self.other, title='First')
+        self.assertEqual(imported.notebook.name, 'Work')
+        self.assertEqual(sorted(imported.tags.values_list('name', flat=True)), ['ideas', 'todo'])
+        self.assertEqual(imported.note_tags.first().updated_at, imported.updated_at)
+        counts = dict(Tag.objects.filter(owner=self.other).values_list('name', 'note_count'))
+        self.assertEqual(counts, {'ideas': 3, 'todo': 1})
+
+    def test_malformed_labels_are_ignored(self):
+        created, skipped = import_notes(self.other, [
+            {'title': 'Odd', 'content': 'x', 'notebook': 7, 'tags': 'not-a-list'},
+            {'title': 'Mixed', 'content': 'x', 'tags': [' Work ', 3, '']},
+        ])
+        self.assertEqual((created, skipped), (2, 0))
+        self.assertIsNone(Note.objects.get(author=self.other, title='Odd').notebook)
+        self.assertEqual(list(Tag.objects.filter(owner=self.other).values_list('name', 'note_count')), [('work', 1)])
+
+    def test_missing_or_bad_timestamps_fall_back_to_now(self):
+        before = timezone.now()
+        import_notes(self.other, [
+            {'title': 'Undated', 'content': 'x'},
+            {'title': 'Garbled', 'content': 'x', 'created_at': '2024-13-45T00:00:00'},
+        ])
+        for note in Note.objects.filter(author=self.other):
+            self.assertGreaterEqual(note.created_at, before)
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_failed_import_removes_the_attachments_it_stored(self):
+        CustomUser.objects.filter(pk=self.other.pk).update(is_premium=True, premium_activated_at=timezone.now())
+        cache.clear()
+        upload = io.BytesIO()
+        with zipfile.ZipFile(upload, 'w') as archive:
+            archive.writestr('media/1/report.pdf', b'%PDF' * 25)
+            archive.writestr('notes.jsonl', '\n'.join([
+                json.dumps({'title': 'Stored', 'content': 'x', 'media': 'media/1/report.pdf'}),
+                json.dumps({'title': 'Next batch', 'content': 'x'}),
+                '{not json',
+            ]))
+        upload.name = 'notes.zip'
+
+        with self.assertRaises(ValueError), transaction.atomic():
+            import_notes(self.other, parse_archive(upload), batch_size=1)
+
+        self.assertFalse(Note.objects.filter(author=self.other).exists())
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.storage_used, 0)
+        self.assertFalse(default_storage.exists(note_media_path(Note(author=self.other), 'report.pdf')))
+
+    async def test_export_streams_chunk_by_chunk_under_asgi(self):
+        client = AsyncClient()
+        await client.aforce_login(self.user)
+        response = await client.get(reverse('notes:note_export'), secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_async)
+
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertGreater(len(chunks), 1)
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+            lines = archive.read('notes.jsonl').decode().splitlines()
+        self.assertEqual(sorted(json.loads(line)['title'] for line in lines), ['First', 'Second'])
+
+
+class NoteLabelTests(TestCase):
+    databases = {'default', REPLICA}
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='labeller', password='pw')
+        self.work = Notebook.objects.create(owner=self.user, name='Work')
+        self.first = Note.objects.create(author=self.user, title='First', content='x', notebook=self.work)
+        self.second = Note.objects.create(author=self.user, title='Second', content='x')
+        self.client.force_login(self.user)
+        self.client.cookies[PIN_COOKIE] = '1'  # read the notes just written, not the empty replica
+
+    def counts(self):
+        return dict(Tag.objects.filter(owner=self.user).values_list('name', 'note_count'))
+
+    def listed(self, **params):
+        response = self.client.get(reverse('notes:note_list'), params, secure=True)
+        self.assertEqual(response.status_code, 200)
+        return [note.title for note in response.context['my_notes']]
+
+    def test_note_count_follows_set_tags(self):
+        self.first.set_tags(['ideas', 'todo'])
+        self.second.set_tags(['ideas'])
+        self.assertEqual(self.counts(), {'ideas': 2, 'todo': 1})
+
+        self.first.set_tags(['todo', 'later'])
+        self.assertEqual(self.counts(), {'ideas': 1, 'todo': 1, 'later': 1})
+
+    def test_note_count_drops_on_clear_and_delete(self):
+        self.first.set_tags(['ideas', 'todo'])
+        self.second.set_tags(['ideas'])
+
+        self.first.tags.clear()
+        self.assertEqual(self.counts(), {'ideas': 1, 'todo': 0})
+        self.second.delete()
+        self.assertEqual(self.counts(), {'ideas': 0, 'todo': 0})
+
+    def test_list_filters_by_tag(self):
+        self.first.set_tags(['ideas'])
+        self.second.set_tags(['ideas', 'todo'])
+        # Another user's tag of the same name doesn't leak into the listing
+        other = CustomUser.objects.create_user(username='other', password='pw')
+        Note.objects.create(author=other, title='Not mine', content='x').set_tags(['ideas'])
+
+        self.assertEqual(sorted(self.listed(tag='ideas')), ['First', 'Second'])
+        self.assertEqual(self.listed(tag='todo'), ['Second'])
+        self.assertEqual(self.listed(tag='unknown'), [])
+
+    def test_list_filters_by_notebook(self):
+        Notebook.objects.create(owner=self.user, name='Empty')
+        self.assertEqual(self.listed(notebook='Work'), ['First'])
+        self.assertEqual(self.listed(notebook='Empty'), [])
+        self.assertEqual(self.listed(notebook='Unknown'), [])
+        self.assertEqual(sorted(self.listed()), ['First', 'Second'])
+
+
+class NoteVersioningTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='writer', password='pw')
+        self.note = Note.objects.create(author=self.user, title='Draft', content='Hello world')
+        self.client.force_login(self.user)
+
+    def patch(self, payload):
+        return self.client.patch(
+            reverse('notes:note_patch', args=[self.note.pk]), json.dumps(payload),
+            content_type='application/json', secure=True,
+        )
+
+    def edit(self, **data):
+        return self.client.post(reverse('notes:note_edit', args=[self.note.pk]), {
+            'title': self.note.title, 'content': self.note.content, 'version': self.note.version,
+            'notebook_name': '', 'tag_names': '', **data,
+        }, secure=True)
+
+    def note_updates(self, queries):
+        return [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE "notes_note" SET')]
+
+    def test_patch_applies_splice_and_bumps_version(self):
+        response = self.patch({'version': 1, 'changes': [{'start': 6, 'end': 11, 'text': 'there'}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['changed'], ['content'])
+        self.note.refresh_from_db()
+        self.assertEqual((self.note.content, self.note.version), ('Hello there', 2))
+
+    def test_patch_with_stale_version_is_rejected(self):
+        Note.objects.get(pk=self.note.pk).save()  # another device saved first: version 2
+        response = self.patch({'version': 1, 'changes': [{'start': 0, 'end': 5, 'text': 'Bye'}]})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['version'], 2)
+        self.assertEqual(response.json()['content'], 'Hello world')
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.content, 'Hello world')
+
+    def test_patch_writes_only_changed_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.patch({'version': 1, 'title': 'Final'})
+        self.assertEqual(response.json()['changed'], ['title'])
+        updates = self.note_updates(queries)
+        self.assertTrue(any('"title"' in sql for sql in updates))
+        self.assertFalse(any('"content"' in sql for sql in updates))
+
+    def test_edit_saves_only_changed_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.edit(title='Final')
+        self.assertEqual(response.status_code, 302)
+        updates = self.note_updates(queries)
+        self.assertTrue(any('"title"' in sql for sql in updates))
+        self.assertFalse(any('"content"' in sql for sql in updates))
+        self.note.refresh_from_db()
+        self.assertEqual((self.note.title, self.note.version), ('Final', 2))
+
+    def test_edit_with_stale_version_keeps_newer_note_and_offers_overwrite(self):
+        newer = Note.objects.get(pk=self.note.pk)
+        newer.content = 'Edited elsewhere'
+        newer.save()
+
+        response = self.edit(content='My edit')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'changed elsewhere')
+        self.assertContains(response, 'My edit')
+        self.assertEqual(response.context['form']['version'].value(), 2)
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.content, 'Edited elsewhere')
+
+        # Saving again from the re-rendered form overwrites deliberately
+        self.assertEqual(self.edit(content='My edit', version=2).status_code, 302)
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.content, 'My edit')
+
+
+@override_settings(NOTES_REVISIONS_FREE=7, NOTES_REVISION_SNAPSHOT_INTERVAL=3)
+class NoteRevisionTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='historian', password='pw')
+        self.note = Note.objects.create(author=self.user, title='History', content=self.text(1))
+        self.history = {1: self.note.content}
+        self.client.force_login(self.user)
+
+    def text(self, step):
+        # Mostly unchanged lines, so later revisions are stored as deltas
+        lines = [f'line {i}\n' for i in range(20)]
+        lines[step % 20] = f'edited in step {step}\n'
+        return ''.join(lines) + ('no trailing newline' if step % 2 else '')
+
+    def edit(self, steps):
+        for step in steps:
+            self.note.content = self.text(step)
+            self.note.save(update_fields=['content'])
+            self.history[self.note.version] = self.note.content
+
+    def assert_kept_versions_rebuild(self):
+        revisions = NoteRevision.objects.filter(note_id=self.note.pk).order_by('version')
+        kept = list(revisions.values_list('version', 'is_snapshot'))
+        self.assertEqual(len(kept), 7)
+        self.assertTrue(kept[0][1], 'the oldest kept revision must be a snapshot')
+        self.assertTrue(any(not is_snapshot for _, is_snapshot in kept))
+        for version, _ in kept:
+            self.assertEqual(content_at(self.note.pk, version), self.history[version])
+        self.assertIsNone(content_at(self.note.pk, kept[0][0] - 1))
+
+    def test_delta_round_trip(self):
+        for old, new in [('', 'a\nb'), ('a\nb\n', ''), ('a\nb\nc', 'a\nB\nc\nd'), ('same\n', 'same\n')]:
+            self.assertEqual(apply_delta(old, make_delta(old, new)), new)
+
+    def test_snapshots_are_written_every_interval(self):
+        self.edit(range(2, 7))
+        snapshots = NoteRevision.objects.filter(note_id=self.note.pk, is_snapshot=True)
+        self.assertEqual(sorted(snapshots.values_list('version', flat=True)), [1, 4])
+
+    def test_every_kept_version_rebuilds_after_pruning(self):
+        self.edit(range(2, 16))
+        self.assert_kept_versions_rebuild()
+
+    def test_every_kept_version_rebuilds_after_restore(self):
+        self.edit(range(2, 16))
+        oldest_kept = NoteRevision.objects.filter(note_id=self.note.pk).order_by('version').first().version
+        response = self.client.post(
+            reverse('notes:note_revision_restore', args=[self.note.pk, oldest_kept]), secure=True
+        )
+        self.assertEqual(response.status_code, 200)
+        self.note.refresh_from_db()
+        self.assertEqual(self.note.content, self.history[oldest_kept])
+        self.history[self.note.version] = self.note.content
+        self.assert_kept_versions_rebuild()
+
+    def test_restore_racing_an_edit_is_a_conflict(self):
+        self.edit(range(2, 4))
+
+        def edit_while_rebuilding(note_id, version):
+            self.edit([10])  # commits between the view reading the note and locking it
+            return content_at(note_id, version)
+
+        with mock.patch('notes.views.content_at', side_effect=edit_while_rebuilding):
+            response = self.client.post(reverse('notes:note_revision_restore', args=[self.note.pk, 1]), secure=True)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['version'], 4)
+        self.note.refresh_from_db()
+        self.assertEqual((self.note.version, self.note.content), (4, self.history[4]))
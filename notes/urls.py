@@ -6,8 +6,15 @@ app_name = 'notes'
 urlpatterns = [
     path('', views.note_list, name='note_list'),
     path('create/', views.note_create, name='note_create'),
+    path('export/', views.note_export, name='note_export'),
+    path('import/', views.note_import, name='note_import'),
     path('<int:pk>/', views.note_detail, name='note_detail'),
     path('<int:pk>/edit/', views.note_edit, name='note_edit'),
+    path('<int:pk>/patch/', views.note_patch, name='note_patch'),
     path('<int:pk>/delete/', views.note_delete, name='note_delete'),
     path('<int:pk>/share/', views.note_share, name='note_share'),
+    path('<int:pk>/events/', views.note_events, name='note_events'),
+    path('<int:pk>/revisions/', views.note_revisions, name='note_revisions'),
+    path('<int:pk>/revisions/<int:version>/', views.note_revision_detail, name='note_revision_detail'),
+    path('<int:pk>/revisions/<int:version>/restore/', views.note_revision_restore, name='note_revision_restore'),
 ]
\ No newline at end of file
@@ -1,21 +1,63 @@
-from django.shortcuts import render, redirect, get_object_or_404
+import json
+import zipfile
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import HttpResponseForbidden
+from django.core.handlers.asgi import ASGIRequest
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.db import connections, transaction
 from django.db.models import Q
-from .models import Note
-from .forms import NoteForm, ShareNoteForm
-from accounts.models import CustomUser
+from django.views.decorators.http import require_http_methods, require_POST
+from .models import Note, Notebook, NoteVersionConflict, Tag
+from .diffs import apply_edits
+from .revisions import content_at
+from .events import get_event_backend, note_channel
+from .forms import ImportNotesForm, NoteForm, ShareNoteForm
+from .archive import aiter_chunks, export_jsonl, export_zip, import_notes, parse_archive
+from accounts.models import CustomUser, StorageQuotaExceeded
+from kitabu_project.db_router import replica_reads
+from notifications.outbox import notify_note_shared
 
 @login_required
-def note_list(request):
-    """Display all notes for the current user"""
-    my_notes = Note.objects.filter(author=request.user)
-    shared_notes = request.user.shared_notes.all()
+@replica_reads
+async def note_list(request):
+    """Display all notes for the current user, optionally filtered by tag or notebook"""
+    user = await request.auser()
+    my_notes = Note.objects.filter(author=user)
+    active_tag = active_notebook = None
     
-    return render(request, 'notes/note_list.html', {
+    # Filtered listings are ordered purely by recency so they stay index range
+    # scans: (tag, -updated_at) on tag links, (notebook, -updated_at) on notes.
+    if request.GET.get('tag'):
+        active_tag = await Tag.objects.filter(owner=user, name=request.GET['tag']).afirst()
+        my_notes = my_notes.filter(note_tags__tag=active_tag).order_by('-note_tags__updated_at')
+        if active_tag is None:
+            my_notes = my_notes.none()
+    if request.GET.get('notebook'):
+        active_notebook = await Notebook.objects.filter(owner=user, name=request.GET['notebook']).afirst()
+        my_notes = my_notes.filter(notebook=active_notebook).order_by('-updated_at')
+        if active_notebook is None:
+            my_notes = my_notes.none()
+    
+    my_notes = [note async for note in my_notes.prefetch_related('shared_with')]
+    shared_notes = [
+        note async for note in user.shared_notes.select_related('author')
+    ]
+    tags = [tag async for tag in Tag.objects.filter(owner=user, note_count__gt=0).order_by('-note_count')[:20]]
+    notebooks = [notebook async for notebook in Notebook.objects.filter(owner=user)]
+    
+    # Templates touch the session (messages, auth context), so render off the event loop
+    return await sync_to_async(render)(request, 'notes/note_list.html', {
         'my_notes': my_notes,
         'shared_notes': shared_notes,
+        'tags': tags,
+        'notebooks': notebooks,
+        'active_tag': active_tag,
+        'active_notebook': active_notebook,
+        'filtered': bool(request.GET.get('tag') or request.GET.get('notebook')),
     })
 
 @login_required
@@ -28,28 +70,132 @@ def note_create(request):
             note.author = request.user
             
             # Check if user is trying to upload media without premium
-            if note.media_file and not request.user.is_premium:
+            if note.media_file and not request.user.has_premium:
                 messages.error(request, 'Media upload requires Premium. Upgrade for only Ksh 87!')
                 return redirect('payments:upgrade')
             
-            note.save()
-            messages.success(request, 'Note created successfully!')
-            return redirect('notes:note_detail', pk=note.pk)
+            try:
+                note.save()
+            except StorageQuotaExceeded:
+                form.add_error('media_file', 'Not enough storage left for this file.')
+            else:
+                form.save_tags(note)
+                messages.success(request, 'Note created successfully!')
+                return redirect('notes:note_detail', pk=note.pk)
     else:
         form = NoteForm(user=request.user)
     
-    return render(request, 'notes/note_form.html', {'form': form, 'action': 'Create'})
+    return render(request, 'notes/note_form.html', {
+        'form': form,
+        'action': 'Create',
+        'notebooks': request.user.notebooks.all(),
+    })
 
 @login_required
-def note_detail(request, pk):
+def note_export(request):
+    """Download all of the user's notes, streamed as it is generated"""
+    if request.GET.get('format') == 'jsonl':
+        chunks, content_type, filename = export_jsonl(request.user), 'application/x-ndjson', 'kitabu-notes.jsonl'
+    else:
+        chunks, content_type, filename = export_zip(request.user), 'application/zip', 'kitabu-notes.zip'
+    if isinstance(request, ASGIRequest):
+        chunks = aiter_chunks(chunks)
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@login_required
+def note_import(request):
+    """Bulk-import notes from an uploaded archive"""
+    if request.method == 'POST':
+        form = ImportNotesForm(request.POST, request.FILES)
+        if form.is_valid():
+            try:
+                with transaction.atomic():
+                    created, skipped = import_notes(request.user, parse_archive(form.cleaned_data['archive']))
+            except (ValueError, zipfile.BadZipFile) as e:
+                messages.error(request, f'Could not read that file: {e}')
+            else:
+                messages.success(request, f'Imported {created} notes.')
+                if skipped:
+                    messages.info(request, f'Skipped {skipped} entries without a title or content.')
+                return redirect('notes:note_list')
+    else:
+        form = ImportNotesForm()
+    
+    return render(request, 'notes/note_import.html', {'form': form})
+
+@login_required
+async def note_detail(request, pk):
     """View a single note"""
-    note = get_object_or_404(Note, pk=pk)
+    user = await request.auser()
+    note = await aget_object_or_404(
+        Note.objects.select_related('author').prefetch_related('shared_with'), pk=pk
+    )
     
     # Check permissions
-    if not note.can_user_edit(request.user):
+    if not await note.acan_user_edit(user):
+        return HttpResponseForbidden("You don't have permission to view this note.")
+    
+    return await sync_to_async(render)(request, 'notes/note_detail.html', {'note': note})
+
+async def _close_db_connections():
+    """Close the current request's database connections; the ORM reopens them when next used"""
+    await sync_to_async(connections.close_all)()
+
+@login_required
+async def note_events(request, pk):
+    """
+    Server-sent event stream of changes to a note, so open note_detail pages
+    only re-fetch when the note actually changed instead of polling.
+    """
+    user = await request.auser()
+    note = await aget_object_or_404(Note, pk=pk)
+    
+    if not await note.acan_user_edit(user):
         return HttpResponseForbidden("You don't have permission to view this note.")
     
-    return render(request, 'notes/note_detail.html', {'note': note})
+    if not isinstance(request, ASGIRequest):
+        # An endless stream would pin a sync worker; 204 tells EventSource to stop retrying
+        return HttpResponse(status=204)
+    
+    # Django only closes a request's connections when its response closes,
+    # which for this stream is when the tab goes away. Release them now so
+    # open note pages don't each hold a database connection.
+    await _close_db_connections()
+    
+    async def stream():
+        subscription = get_event_backend().subscribe(note_channel(note.pk))
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                message = await subscription.get(timeout=settings.NOTES_EVENT_HEARTBEAT)
+                if message is None:
+                    yield ': keep-alive\n\n'
+                    continue
+                
+                event = message['event']
+                if event in ('shared', 'unshared') and note.author_id != user.pk:
+                    # Sharees only hear about sharing changes that cost them access
+                    if event == 'shared' or (message['users'] and user.pk not in message['users']):
+                        continue
+                    still_allowed = await note.acan_user_edit(user)
+                    await _close_db_connections()
+                    if still_allowed:
+                        continue
+                    event = 'revoked'
+                    message = {'event': event, 'note': note.pk}
+                
+                yield f"event: {event}\ndata: {json.dumps(message)}\n\n"
+                if event in ('deleted', 'revoked'):
+                    return
+        finally:
+            subscription.close()
+    
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 @login_required
 def note_edit(request, pk):
@@ -63,20 +209,158 @@ def note_edit(request, pk):
     if request.method == 'POST':
         form = NoteForm(request.POST, request.FILES, instance=note, user=request.user)
         if form.is_valid():
+            base_version = form.cleaned_data['version'] or note.version
             updated_note = form.save(commit=False)
             
-            # Check media upload permission
-            if updated_note.media_file and not request.user.is_premium:
+            # Check media upload permission; an attachment kept from before premium lapsed is fine
+            if 'media_file' in form.changed_data and not request.user.has_premium:
                 messages.error(request, 'Media upload requires Premium!')
                 return redirect('payments:upgrade')
             
-            updated_note.save()
-            messages.success(request, 'Note updated successfully!')
-            return redirect('notes:note_detail', pk=note.pk)
+            # Only write the columns the user actually changed
+            changed_fields = form.changed_model_fields
+            try:
+                with transaction.atomic():
+                    updated_note.lock_version(base_version)
+                    if changed_fields:
+                        updated_note.save(update_fields=changed_fields)
+                    form.save_tags(updated_note)
+            except NoteVersionConflict as conflict:
+                # Keep the user's text; saving again deliberately overwrites the newer version
+                note.refresh_from_db()
+                data = request.POST.copy()
+                data['version'] = conflict.current_version
+                form = NoteForm(data, request.FILES, instance=note, user=request.user)
+                messages.error(request, 'This note was changed elsewhere since you opened it. '
+                                        'Save again to overwrite those changes.')
+            except StorageQuotaExceeded:
+                note.refresh_from_db()
+                form.add_error('media_file', 'Not enough storage left for this file.')
+            else:
+                messages.success(request, 'Note updated successfully!')
+                return redirect('notes:note_detail', pk=note.pk)
     else:
         form = NoteForm(instance=note, user=request.user)
     
-    return render(request, 'notes/note_form.html', {'form': form, 'action': 'Edit', 'note': note})
+    return render(request, 'notes/note_form.html', {
+        'form': form,
+        'action': 'Edit',
+        'note': note,
+        'notebooks': request.user.notebooks.all(),
+    })
+
+@login_required
+@require_http_methods(['PATCH'])
+def note_patch(request, pk):
+    """
+    Apply an incremental edit to a note.
+    
+    Expects a JSON body like {"version": 4, "changes": [{"start": 10, "end": 15,
+    "text": "new words"}], "title": "...", "is_pinned": true}; every key but
+    "version" is optional. Changes are splices against the content at that
+    version (see notes.diffs.apply_edits). If the note has moved on since, a 409
+    with the current version and text is returned so the client can rebase.
+    """
+    # Don't pull the (possibly long) content until the row is locked
+    note = get_object_or_404(Note.objects.only('id', 'author_id', 'version'), pk=pk, author=request.user)
+    
+    try:
+        payload = json.loads(request.body)
+        base_version = int(payload['version'])
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Body must be JSON with an integer "version".'}, status=400)
+    
+    try:
+        with transaction.atomic():
+            note.lock_version(base_version)
+            note.refresh_from_db(fields=['title', 'content', 'is_pinned'])
+            changed_fields = []
+            
+            if payload.get('changes'):
+                content = apply_edits(note.content, payload['changes'])
+                if content != note.content:
+                    note.content = content
+                    changed_fields.append('content')
+            for name in ('title', 'is_pinned'):
+                if name in payload:
+                    value = Note._meta.get_field(name).clean(payload[name], note)
+                    if value != getattr(note, name):
+                        setattr(note, name, value)
+                        changed_fields.append(name)
+            
+            if changed_fields:
+                note.save(update_fields=changed_fields)
+    except NoteVersionConflict as conflict:
+        current = Note.objects.only('title', 'content').get(pk=note.pk)
+        return JsonResponse({
+            'error': 'Note was changed since this version.',
+            'version': conflict.current_version,
+            'title': current.title,
+            'content': current.content,
+        }, status=409)
+    except ValidationError as e:
+        return JsonResponse({'error': ' '.join(e.messages)}, status=400)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    return JsonResponse({
+        'id': note.pk,
+        'version': note.version,
+        'updated_at': note.updated_at.isoformat(),
+        'changed': changed_fields,
+    })
+
+@login_required
+def note_revisions(request, pk):
+    """List the stored revisions of a note (newest first)"""
+    note = get_object_or_404(Note, pk=pk, author=request.user)
+    revisions = note.revisions.values('version', 'is_snapshot', 'created_at')
+    
+    return JsonResponse({
+        'id': note.pk,
+        'version': note.version,
+        'revisions': [
+            {
+                'version': revision['version'],
+                'created_at': revision['created_at'].isoformat(),
+                'snapshot': revision['is_snapshot'],
+            }
+            for revision in revisions
+        ],
+    })
+
+@login_required
+def note_revision_detail(request, pk, version):
+    """Return a note's content as of one revision"""
+    note = get_object_or_404(Note.objects.only('id', 'author_id'), pk=pk, author=request.user)
+    content = content_at(note.pk, version)
+    if content is None:
+        return JsonResponse({'error': 'Revision not found.'}, status=404)
+    
+    return JsonResponse({'id': note.pk, 'version': version, 'content': content})
+
+@login_required
+@require_POST
+def note_revision_restore(request, pk, version):
+    """Restore a note's content to an earlier revision (recorded as a new revision)"""
+    note = get_object_or_404(Note, pk=pk, author=request.user)
+    content = content_at(note.pk, version)
+    if content is None:
+        return JsonResponse({'error': 'Revision not found.'}, status=404)
+    
+    try:
+        with transaction.atomic():
+            note.lock_version(note.version)
+            note.content = content
+            note.save(update_fields=['content'])
+    except NoteVersionConflict as conflict:
+        # An edit landed while the revision was being rebuilt
+        return JsonResponse({
+            'error': 'Note was changed while restoring; try again.',
+            'version': conflict.current_version,
+        }, status=409)
+    
+    return JsonResponse({'id': note.pk, 'version': note.version, 'restored_from': version})
 
 @login_required
 def note_delete(request, pk):
@@ -95,7 +379,7 @@ def note_share(request, pk):
     """Share a note with another user (premium feature)"""
     note = get_object_or_404(Note, pk=pk, author=request.user)
     
-    if not request.user.is_premium:
+    if not request.user.has_premium:
         messages.error(request, 'Sharing notes requires Premium!')
         return redirect('payments:upgrade')
     
@@ -110,7 +394,9 @@ def note_share(request, pk):
                 elif user_to_share in note.shared_with.all():
                     messages.info(request, f'Note already shared with {username}')
                 else:
-                    note.shared_with.add(user_to_share)
+                    with transaction.atomic():
+                        note.shared_with.add(user_to_share)
+                        notify_note_shared(note, user_to_share, request.user)
                     messages.success(request, f'Note shared with {username}!')
                 return redirect('notes:note_detail', pk=note.pk)
             except CustomUser.DoesNotExist:
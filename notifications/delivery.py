@@ -0,0 +1,119 @@
+"""
+Draining the notification outbox.
+
+Each round claims a batch of due rows by stamping them with a random claim
+token (and pushing next_attempt_at out by a lease, so a crashed worker's
+rows become due again), then sends them over one email connection and one
+SMS gateway session. Sent rows are marked in a single UPDATE; failures are
+retried with exponential backoff until NOTIFICATIONS_MAX_ATTEMPTS, after
+which they are marked failed. Claiming with a conditional UPDATE works the
+same on PostgreSQL and SQLite and keeps two workers from sending a row twice.
+"""
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils import timezone
+
+from .models import Notification
+from .sms import get_sms_backend
+
+CLAIM_LEASE = timedelta(minutes=5)
+
+
+def retry_delay(attempts):
+    """Backoff before the next attempt: base, 2x base, 4x base ... capped at a day"""
+    return timedelta(seconds=min(settings.NOTIFICATIONS_RETRY_BASE * 2 ** (attempts - 1), 86400))
+
+
+def claim_batch(batch_size):
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    due = Notification.objects.filter(status=Notification.PENDING, next_attempt_at__lte=now)
+    ids = list(due.order_by('next_attempt_at', 'pk').values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return []
+    # Only rows still due are taken; another worker may have claimed some meanwhile
+    due.filter(pk__in=ids).update(claim=token, next_attempt_at=now + CLAIM_LEASE)
+    return list(Notification.objects.filter(claim=token, status=Notification.PENDING).order_by('pk'))
+
+
+def _send_all(notifications):
+    """Send a claimed batch; returns (sent ids, {id: error})"""
+    sent, errors = [], {}
+    emails = [n for n in notifications if n.channel == Notification.EMAIL]
+    texts = [n for n in notifications if n.channel == Notification.SMS]
+
+    if emails:
+        connection = get_connection()
+        try:
+            connection.open()
+            for n in emails:
+                try:
+                    EmailMessage(n.subject, n.body, settings.DEFAULT_FROM_EMAIL, [n.recipient],
+                                 connection=connection).send()
+                    sent.append(n.pk)
+                except Exception as e:
+                    errors[n.pk] = str(e) or e.__class__.__name__
+        except Exception as e:  # couldn't connect at all
+            for n in emails:
+                errors.setdefault(n.pk, str(e) or e.__class__.__name__)
+        finally:
+            connection.close()
+
+    if texts:
+        gateway = get_sms_backend()
+        try:
+            gateway.open()
+            for n in texts:
+                try:
+                    gateway.send(n.recipient, n.body)
+                    sent.append(n.pk)
+                except Exception as e:
+                    errors[n.pk] = str(e) or e.__class__.__name__
+        except Exception as e:
+            for n in texts:
+                errors.setdefault(n.pk, str(e) or e.__class__.__name__)
+        finally:
+            gateway.close()
+
+    return sent, errors
+
+
+def deliver_batch(batch_size=100):
+    """Send one batch of due notifications; returns (sent, retried, failed) counts"""
+    notifications = claim_batch(batch_size)
+    if not notifications:
+        return 0, 0, 0
+    sent, errors = _send_all(notifications)
+
+    now = timezone.now()
+    Notification.objects.filter(pk__in=sent).update(
+        status=Notification.SENT, sent_at=now, claim='', last_error=''
+    )
+
+    retried = failed = 0
+    failures = [n for n in notifications if n.pk in errors]
+    for n in failures:
+        n.attempts += 1
+        n.last_error = errors[n.pk]
+        n.claim = ''
+        if n.attempts >= settings.NOTIFICATIONS_MAX_ATTEMPTS:
+            n.status = Notification.FAILED
+            failed += 1
+        else:
+            n.next_attempt_at = now + retry_delay(n.attempts)
+            retried += 1
+    Notification.objects.bulk_update(failures, ['attempts', 'last_error', 'claim', 'status', 'next_attempt_at'])
+    return len(sent), retried, failed
+
+
+def deliver_pending(batch_size=100):
+    """Send batches until nothing is due; returns total (sent, retried, failed)"""
+    totals = [0, 0, 0]
+    while True:
+        counts = deliver_batch(batch_size)
+        if not any(counts):
+            return tuple(totals)
+        totals = [total + count for total, count in zip(totals, counts)]
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from notifications.delivery import deliver_pending
+
+
+class Command(BaseCommand):
+    """
+    Outbox worker: sends due notifications in batches, then polls for more.
+    Run it alongside the web process (or with --once from cron).
+    """
+    help = 'Send queued email and SMS notifications'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to wait when the outbox is empty')
+        parser.add_argument('--once', action='store_true', help='Send what is due now and exit')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1.')
+
+        try:
+            while True:
+                sent, retried, failed = deliver_pending(options['batch_size'])
+                if sent or retried or failed:
+                    self.stdout.write(f'Sent {sent}, will retry {retried}, gave up on {failed}.')
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+class Notification(models.Model):
+    """
+    Outbox row for an email or SMS. Rows are written in the same transaction
+    as the change they announce and sent later by the send_notifications
+    worker, so a request never waits on a mail server or SMS gateway and a
+    rolled-back change never notifies anyone. See notifications/delivery.py.
+    """
+    EMAIL = 'email'
+    SMS = 'sms'
+    CHANNEL_CHOICES = [
+        (EMAIL, 'Email'),
+        (SMS, 'SMS'),
+    ]
+    
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),  # gave up after NOTIFICATIONS_MAX_ATTEMPTS
+    ]
+    
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        related_name='notifications',
+        null=True,
+        blank=True
+    )
+    channel = models.CharField(max_length=10, choices=CHANNEL_CHOICES)
+    recipient = models.CharField(max_length=254)  # email address or phone number
+    subject = models.CharField(max_length=200, blank=True)
+    body = models.TextField()
+    # Enqueueing the same key twice (e.g. a retried payment callback) is a no-op
+    dedupe_key = models.CharField(max_length=200, unique=True)
+    
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim = models.CharField(max_length=32, blank=True)  # set by the worker sending it
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.channel} to {self.recipient} ({self.status})"
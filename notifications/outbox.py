@@ -0,0 +1,88 @@
+"""
+Writing notifications to the outbox. Call these inside the transaction
+that makes the change; nothing is sent until the worker picks the rows up.
+"""
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.urls import reverse
+
+from .models import Notification
+from .tasks import deliver_notifications
+
+
+def _schedule_delivery():
+    """
+    Queue one delivery job per NOTIFICATIONS_COALESCE_SECONDS window, due as
+    the window closes, so a burst of shares costs a single drain. Anything
+    committed after that job ran goes out with the next minute's sweep.
+    """
+    window = settings.NOTIFICATIONS_COALESCE_SECONDS
+    slot = int(time.time() // window)
+    deliver_notifications.defer(
+        run_at=datetime.fromtimestamp((slot + 1) * window, tz=dt_timezone.utc),
+        unique_key=f'deliver-notifications:{slot}',
+    )
+
+
+def enqueue(notifications):
+    """Add Notification instances to the outbox, skipping ones whose dedupe_key is already there"""
+    Notification.objects.bulk_create(notifications, ignore_conflicts=True)
+    _schedule_delivery()  # send promptly rather than at the next sweep
+
+
+def _absolute(path):
+    return settings.SITE_URL.rstrip('/') + path
+
+
+def notify_note_shared(note, user, shared_by):
+    """Email a user that a note has been shared with them; call after adding the share"""
+    if not user.email:
+        return
+    # Keyed on the share row, so a retried share sends one email but sharing
+    # again after an unshare is a new share and a new email
+    share_id = note.shared_with.through.objects.filter(note=note, customuser=user).values_list('pk', flat=True).first()
+    body = render_to_string('notifications/note_shared.txt', {
+        'note': note,
+        'user': user,
+        'shared_by': shared_by,
+        'note_url': _absolute(reverse('notes:note_detail', args=[note.pk])),
+    })
+    enqueue([Notification(
+        user=user,
+        channel=Notification.EMAIL,
+        recipient=user.email,
+        subject=f'{shared_by.username} shared "{note.title}" with you',
+        body=body,
+        dedupe_key=f'note-shared:{note.pk}:{user.pk}:{share_id}',
+    )])
+
+
+def notify_payment_completed(payment):
+    """Confirm a completed payment by SMS to the paying number, and by email if the user has one"""
+    user = payment.user
+    context = {
+        'payment': payment,
+        'user': user,
+        'expires_at': user.premium_expires_at,
+        'notes_url': _absolute(reverse('notes:note_list')),
+    }
+    notifications = [Notification(
+        user=user,
+        channel=Notification.SMS,
+        recipient=payment.phone_number,
+        body=render_to_string('notifications/payment_completed_sms.txt', context).strip(),
+        dedupe_key=f'payment-completed:{payment.pk}:sms',
+    )]
+    if user.email:
+        notifications.append(Notification(
+            user=user,
+            channel=Notification.EMAIL,
+            recipient=user.email,
+            subject='Your Kitabu Premium is active',
+            body=render_to_string('notifications/payment_completed.txt', context),
+            dedupe_key=f'payment-completed:{payment.pk}:email',
+        ))
+    enqueue(notifications)
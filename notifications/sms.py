@@ -0,0 +1,41 @@
+"""
+SMS gateways. SMS_BACKEND names the class to use; the console backend is a
+stub that prints messages instead of sending them, for local development.
+A real gateway subclasses BaseSMSBackend.
+"""
+import sys
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class SMSError(Exception):
+    """The gateway rejected or failed to send a message"""
+
+
+class BaseSMSBackend:
+    def open(self):
+        """Open a connection to the gateway, if it uses one"""
+
+    def close(self):
+        pass
+
+    def send(self, phone_number, text):
+        """Send one message, raising SMSError if it can't be delivered"""
+        raise NotImplementedError
+
+
+class ConsoleSMSBackend(BaseSMSBackend):
+    """Writes messages to stdout"""
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+
+    def send(self, phone_number, text):
+        self.stream.write(f'SMS to {phone_number}: {text}\n')
+        self.stream.flush()
+
+
+@lru_cache(maxsize=None)
+def get_sms_backend():
+    return import_string(settings.SMS_BACKEND)()
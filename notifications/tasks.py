@@ -0,0 +1,11 @@
+from datetime import timedelta
+
+from jobs.registry import task
+
+from .delivery import deliver_pending
+
+
+@task(every=timedelta(minutes=1))
+def deliver_notifications():
+    """Send what is due; also queued whenever notifications are added, so the minute sweep only picks up retries"""
+    deliver_pending()
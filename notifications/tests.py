@@ -0,0 +1,138 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from jobs.models import Job
+from notes.models import Note
+from .delivery import claim_batch, deliver_batch, deliver_pending, retry_delay
+from .models import Notification
+from .outbox import enqueue, notify_note_shared
+from .sms import BaseSMSBackend, SMSError, get_sms_backend
+
+
+class RecordingSMSBackend(BaseSMSBackend):
+    sent = []
+
+    def send(self, phone_number, text):
+        self.sent.append((phone_number, text))
+
+
+class FailingSMSBackend(BaseSMSBackend):
+    def send(self, phone_number, text):
+        raise SMSError('gateway down')
+
+
+class SMSBackendMixin:
+    sms_backend = 'notifications.tests.RecordingSMSBackend'
+
+    def setUp(self):
+        # The gateway is built once per process; rebuild it for this test's setting
+        override = override_settings(SMS_BACKEND=self.sms_backend)
+        override.enable()
+        self.addCleanup(override.disable)
+        get_sms_backend.cache_clear()
+        self.addCleanup(get_sms_backend.cache_clear)
+        RecordingSMSBackend.sent = []
+        self.user = CustomUser.objects.create_user(username='reader', email='reader@example.com', password='pw')
+
+
+def text(key, phone='254700000000'):
+    return Notification(channel=Notification.SMS, recipient=phone, body='Hello', dedupe_key=key)
+
+
+def email(key, address='reader@example.com'):
+    return Notification(channel=Notification.EMAIL, recipient=address, subject='Hi', body='Hello', dedupe_key=key)
+
+
+class OutboxTests(SMSBackendMixin, TestCase):
+
+    def test_burst_of_notifications_shares_one_delivery_job(self):
+        author = CustomUser.objects.create_user(username='author', password='pw')
+        window = settings.NOTIFICATIONS_COALESCE_SECONDS
+        with mock.patch('notifications.outbox.time') as clock:
+            for i in range(3):
+                clock.time.return_value = 100 * window + i * window / 3  # all inside one window
+                note = Note.objects.create(author=author, title=f'Note {i}', content='x')
+                note.shared_with.add(self.user)
+                notify_note_shared(note, self.user, author)
+
+            clock.time.return_value = 101 * window  # the next window gets its own job
+            enqueue([email('later')])
+
+        self.assertEqual(Notification.objects.count(), 4)
+        jobs = Job.objects.filter(name='notifications.tasks.deliver_notifications').order_by('run_at')
+        self.assertEqual(
+            [job.run_at.timestamp() for job in jobs],
+            [101 * window, 102 * window],  # each runs as its window closes
+        )
+
+    def test_share_emails_once_per_share(self):
+        author = CustomUser.objects.create_user(username='author', password='pw')
+        note = Note.objects.create(author=author, title='Plans', content='x')
+        note.shared_with.add(self.user)
+        notify_note_shared(note, self.user, author)
+        notify_note_shared(note, self.user, author)  # a retry of the same share
+        self.assertEqual(Notification.objects.count(), 1)
+
+        note.shared_with.remove(self.user)
+        note.shared_with.add(self.user)
+        notify_note_shared(note, self.user, author)
+        self.assertEqual(Notification.objects.filter(recipient='reader@example.com').count(), 2)
+
+    def test_duplicate_dedupe_key_is_ignored(self):
+        enqueue([email('same')])
+        enqueue([email('same', address='other@example.com')])
+        self.assertEqual(list(Notification.objects.values_list('recipient', flat=True)), ['reader@example.com'])
+
+
+class DeliveryTests(SMSBackendMixin, TestCase):
+
+    def test_delivery_sends_each_channel_and_marks_rows_sent(self):
+        enqueue([email('e1'), text('t1')])
+        self.assertEqual(deliver_pending(), (2, 0, 0))
+        self.assertEqual([message.to for message in mail.outbox], [['reader@example.com']])
+        self.assertEqual(RecordingSMSBackend.sent, [('254700000000', 'Hello')])
+        self.assertEqual(set(Notification.objects.values_list('status', flat=True)), {Notification.SENT})
+        self.assertEqual(deliver_pending(), (0, 0, 0))
+
+    def test_claimed_rows_are_not_claimed_again(self):
+        enqueue([text(f't{i}') for i in range(3)])
+        self.assertEqual(len(claim_batch(2)), 2)
+        self.assertEqual(len(claim_batch(10)), 1)
+        self.assertEqual(claim_batch(10), [])
+
+    def test_future_rows_wait(self):
+        enqueue([text('t1')])
+        Notification.objects.update(next_attempt_at=timezone.now() + timedelta(minutes=1))
+        self.assertEqual(deliver_batch(), (0, 0, 0))
+
+
+class FailedDeliveryTests(SMSBackendMixin, TestCase):
+    sms_backend = 'notifications.tests.FailingSMSBackend'
+
+    def test_failures_back_off_then_give_up(self):
+        enqueue([text('t1')])
+        for attempt in range(1, settings.NOTIFICATIONS_MAX_ATTEMPTS):
+            before = timezone.now()
+            self.assertEqual(deliver_batch(), (0, 1, 0))
+            notification = Notification.objects.get()
+            self.assertEqual(notification.attempts, attempt)
+            self.assertEqual(notification.last_error, 'gateway down')
+            self.assertGreaterEqual(notification.next_attempt_at, before + retry_delay(attempt))
+            self.assertEqual(deliver_batch(), (0, 0, 0))  # not due until the backoff passes
+            Notification.objects.update(next_attempt_at=timezone.now())
+
+        self.assertEqual(deliver_batch(), (0, 0, 1))
+        self.assertEqual(Notification.objects.get().status, Notification.FAILED)
+        self.assertEqual(retry_delay(2), 2 * retry_delay(1))
+
+    def test_one_failing_channel_does_not_hold_back_the_other(self):
+        enqueue([email('e1'), text('t1')])
+        self.assertEqual(deliver_batch(), (1, 1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(Notification.objects.get(channel=Notification.EMAIL).status, Notification.SENT)
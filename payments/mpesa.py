@@ -0,0 +1,65 @@
+"""
+M-Pesa (Daraja) API client.
+
+requests is imported on first use rather than when the views load, so
+workers don't pay for it at boot. Calls share a pooled HTTP session per
+process; a session inherited through fork (gunicorn --preload) would
+share sockets with its parent, so it is rebuilt whenever the pid changes.
+"""
+import os
+
+from django.conf import settings
+
+_session = None
+_session_pid = None
+
+
+class MpesaError(Exception):
+    """A request to the M-Pesa API failed or returned something unusable"""
+
+
+def _base_url():
+    if settings.MPESA_ENVIRONMENT == 'sandbox':
+        return 'https://sandbox.safaricom.co.ke'
+    return 'https://api.safaricom.co.ke'
+
+
+def http_session():
+    global _session, _session_pid
+    if _session is None or _session_pid != os.getpid():
+        import requests
+        _session = requests.Session()
+        _session_pid = os.getpid()
+    return _session
+
+
+def _request(method, path, **kwargs):
+    import requests
+    try:
+        response = http_session().request(method, _base_url() + path, timeout=30, **kwargs)
+        response.raise_for_status()
+        return response.json()
+    except (requests.RequestException, ValueError) as e:
+        raise MpesaError(str(e)) from e
+
+
+def get_access_token():
+    """OAuth access token for the API, or None if it couldn't be fetched"""
+    try:
+        return _request(
+            'GET', '/oauth/v1/generate',
+            params={'grant_type': 'client_credentials'},
+            auth=(settings.MPESA_CONSUMER_KEY, settings.MPESA_CONSUMER_SECRET),
+        )['access_token']
+    except (MpesaError, KeyError) as e:
+        print(f"Error getting M-Pesa token: {e}")
+        return None
+
+
+def stk_push(access_token, payload):
+    """Send an STK Push (payment prompt) request; returns the decoded response"""
+    return _request(
+        'POST', '/mpesa/stkpush/v1/processrequest',
+        json=payload,
+        headers={'Authorization': f'Bearer {access_token}'},
+    )
@@ -1,3 +1,151 @@
+import json
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.entitlements import has_premium, premium_period
+from accounts.models import CustomUser
+from .models import Payment
+
+
+class PaymentCallbackTests(TestCase):
+
+    def setUp(self):
+        cache.clear()  # entitlements are cached by user id, which the test database reuses
+        self.user = CustomUser.objects.create_user(username='payer', password='pw')
+        self.payment = Payment.objects.create(
+            user=self.user, phone_number='254700000000',
+            merchant_request_id='merchant-1', checkout_request_id='checkout-1',
+        )
+
+    def callback(self, result_code=0):
+        body = {'Body': {'stkCallback': {
+            'MerchantRequestID': 'merchant-1',
+            'CheckoutRequestID': 'checkout-1',
+            'ResultCode': result_code,
+            'CallbackMetadata': {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': 'RCPT1'}]},
+        }}}
+        response = self.client.post(
+            reverse('payments:callback'), json.dumps(body),
+            content_type='application/json', secure=True,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+
+    def test_payment_starts_premium_now(self):
+        before = timezone.now()
+        self.callback()
+        self.assertTrue(self.user.is_premium)
+        self.assertGreaterEqual(self.user.premium_activated_at, before)
+
+    def test_early_renewal_extends_from_current_expiry(self):
+        self.user.is_premium = True
+        self.user.premium_activated_at = timezone.now() - timedelta(days=10)
+        self.user.save()
+        expires_at = self.user.premium_expires_at
+
+        self.callback()
+        self.assertEqual(self.user.premium_expires_at, expires_at + premium_period())
+
+    def test_renewal_after_lapse_starts_now(self):
+        self.user.is_premium = True
+        self.user.premium_activated_at = timezone.now() - timedelta(days=45)
+        self.user.save()
+        before = timezone.now()
+
+        self.callback()
+        self.assertGreaterEqual(self.user.premium_activated_at, before)
+        self.assertTrue(self.user.has_premium)
+
+    def test_retried_callback_does_not_extend_twice(self):
+        self.callback()
+        expires_at = self.user.premium_expires_at
+        self.callback()
+        self.assertEqual(self.user.premium_expires_at, expires_at)
+
+    def test_failed_payment_leaves_premium_off(self):
+        self.callback(result_code=1032)
+        self.assertFalse(self.user.is_premium)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'failed')
+
+
+STK_ACCEPTED = {'ResponseCode': '0', 'MerchantRequestID': 'merchant-2', 'CheckoutRequestID': 'checkout-2'}
+
+
+# The views are async; each is exercised through the sync test client (as
+# under WSGI) and the async one (as under ASGI)
+@mock.patch('payments.mpesa.stk_push', return_value=STK_ACCEPTED)
+@mock.patch('payments.mpesa.get_access_token', return_value='token')
+class InitiatePaymentTests(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='payer', password='pw')
+        self.client.force_login(self.user)
+
+    def test_stk_push_creates_pending_payment(self, get_access_token, stk_push):
+        response = self.client.post(reverse('payments:initiate'), {'phone_number': '0700 000 000'}, secure=True)
+        self.assertContains(response, '254700000000')
+        payment = Payment.objects.get(user=self.user)
+        self.assertEqual((payment.status, payment.checkout_request_id), ('pending', 'checkout-2'))
+        self.assertEqual(stk_push.call_args.args[1]['PhoneNumber'], '254700000000')
+
+    async def test_stk_push_creates_pending_payment_under_asgi(self, get_access_token, stk_push):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.post(
+            reverse('payments:initiate'), {'phone_number': '254700000000'}, secure=True
+        )
+        self.assertContains(response, '254700000000')
+        self.assertEqual(await Payment.objects.filter(user=self.user, status='pending').acount(), 1)
+
+    def test_invalid_phone_number_is_rejected(self, get_access_token, stk_push):
+        response = self.client.post(reverse('payments:initiate'), {'phone_number': '12345'}, secure=True)
+        self.assertRedirects(response, reverse('payments:upgrade'), fetch_redirect_response=False)
+        stk_push.assert_not_called()
+
+    def test_unavailable_gateway_sends_user_back(self, get_access_token, stk_push):
+        get_access_token.return_value = None
+        response = self.client.post(reverse('payments:initiate'), {'phone_number': '254700000000'}, secure=True)
+        self.assertRedirects(response, reverse('payments:upgrade'), fetch_redirect_response=False)
+        self.assertFalse(Payment.objects.exists())
+
+
+class PaymentStatusTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='payer', password='pw')
+        self.payment = Payment.objects.create(
+            user=self.user, phone_number='254700000000',
+            merchant_request_id='merchant-1', checkout_request_id='checkout-1',
+        )
+        self.url = reverse('payments:status', args=[self.payment.pk])
+
+    def test_owner_sees_status(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url, secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['payment'], self.payment)
+
+    async def test_owner_sees_status_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(self.url, secure=True)
+        self.assertEqual(response.status_code, 200)
+
+    def test_other_users_payments_are_hidden(self):
+        self.client.force_login(CustomUser.objects.create_user(username='other', password='pw'))
+        self.assertEqual(self.client.get(self.url, secure=True).status_code, 404)
+
+    def test_completed_payment_refreshes_cached_entitlements(self):
+        self.client.force_login(self.user)
+        self.assertFalse(has_premium(self.user.pk))  # cached as not premium
+        # Completed by a callback handled elsewhere, without touching this cache
+        Payment.objects.filter(pk=self.payment.pk).update(status='completed')
+        CustomUser.objects.filter(pk=self.user.pk).update(is_premium=True, premium_activated_at=timezone.now())
 
-# Create your tests here.
+        self.client.get(self.url, secure=True)
+        self.assertTrue(has_premium(self.user.pk))
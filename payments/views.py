@@ -1,44 +1,31 @@
 import json
 import base64
-import requests
 from datetime import datetime
-from django.shortcuts import render, redirect
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, aget_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 from django.http import JsonResponse
-from django.utils import timezone
+from django.db import transaction
+from accounts.entitlements import invalidate_entitlements, renewal_start
+from accounts.models import CustomUser
+from notifications.outbox import notify_payment_completed
+from . import mpesa
 from .models import Payment
 
-def get_mpesa_access_token():
-    """Get OAuth access token from M-Pesa API"""
-    consumer_key = settings.MPESA_CONSUMER_KEY
-    consumer_secret = settings.MPESA_CONSUMER_SECRET
-    
-    if settings.MPESA_ENVIRONMENT == 'sandbox':
-        api_url = "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
-    else:
-        api_url = "https://api.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials"
-    
-    try:
-        response = requests.get(api_url, auth=(consumer_key, consumer_secret))
-        response.raise_for_status()
-        return response.json()['access_token']
-    except Exception as e:
-        print(f"Error getting M-Pesa token: {e}")
-        return None
-
 @login_required
 def upgrade_view(request):
     """Display premium upgrade page"""
     return render(request, 'payments/upgrade.html', {
         'amount': 87,
+        'duration_days': settings.PREMIUM_DURATION_DAYS,
         'user': request.user,
     })
 
 @login_required
-def initiate_payment(request):
+async def initiate_payment(request):
     """Initiate STK Push for M-Pesa payment"""
     if request.method != 'POST':
         return redirect('payments:upgrade')
@@ -58,18 +45,16 @@ def initiate_payment(request):
         messages.error(request, 'Invalid phone number. Use format: 254XXXXXXXXX')
         return redirect('payments:upgrade')
     
-    # Get access token
-    access_token = get_mpesa_access_token()
+    user = await request.auser()
+    
+    # Get access token. The M-Pesa calls block on the network, so run them in a
+    # worker thread rather than tying up the event loop (or a whole sync worker).
+    access_token = await sync_to_async(mpesa.get_access_token, thread_sensitive=False)()
     if not access_token:
         messages.error(request, 'Payment service unavailable. Please try again later.')
         return redirect('payments:upgrade')
     
     # Prepare STK Push request
-    if settings.MPESA_ENVIRONMENT == 'sandbox':
-        api_url = "https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
-    else:
-        api_url = "https://api.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
-    
     timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
     shortcode = settings.MPESA_SHORTCODE
     passkey = settings.MPESA_PASSKEY
@@ -78,11 +63,6 @@ def initiate_payment(request):
     password_str = f"{shortcode}{passkey}{timestamp}"
     password = base64.b64encode(password_str.encode()).decode('utf-8')
     
-    headers = {
-        'Authorization': f'Bearer {access_token}',
-        'Content-Type': 'application/json',
-    }
-    
     payload = {
         'BusinessShortCode': shortcode,
         'Password': password,
@@ -93,19 +73,17 @@ def initiate_payment(request):
         'PartyB': shortcode,
         'PhoneNumber': phone_number,
         'CallBackURL': settings.MPESA_CALLBACK_URL,
-        'AccountReference': f'Kitabu-{request.user.username}',
+        'AccountReference': f'Kitabu-{user.username}',
         'TransactionDesc': 'Kitabu Premium Upgrade',
     }
     
     try:
-        response = requests.post(api_url, json=payload, headers=headers, timeout=30)
-        response.raise_for_status()
-        result = response.json()
+        result = await sync_to_async(mpesa.stk_push, thread_sensitive=False)(access_token, payload)
         
         if result.get('ResponseCode') == '0':
             # Create payment record
-            payment = Payment.objects.create(
-                user=request.user,
+            payment = await Payment.objects.acreate(
+                user=user,
                 phone_number=phone_number,
                 merchant_request_id=result['MerchantRequestID'],
                 checkout_request_id=result['CheckoutRequestID'],
@@ -113,7 +91,7 @@ def initiate_payment(request):
             )
             
             messages.success(request, 'Payment request sent! Please check your phone and enter your M-Pesa PIN.')
-            return render(request, 'payments/payment_pending.html', {
+            return await sync_to_async(render)(request, 'payments/payment_pending.html', {
                 'payment': payment,
                 'phone_number': phone_number,
             })
@@ -121,7 +99,7 @@ def initiate_payment(request):
             messages.error(request, f"Payment failed: {result.get('ResponseDescription', 'Unknown error')}")
             return redirect('payments:upgrade')
     
-    except requests.exceptions.RequestException as e:
+    except mpesa.MpesaError as e:
         print(f"M-Pesa API Error: {e}")
         messages.error(request, 'Payment request failed. Please try again.')
         return redirect('payments:upgrade')
@@ -162,13 +140,20 @@ def mpesa_callback(request):
                     payment.transaction_date = datetime.strptime(trans_date_str, '%Y%m%d%H%M%S')
             
             payment.status = 'completed'
-            payment.save()
             
-            # Activate premium for user
-            user = payment.user
-            user.is_premium = True
-            user.premium_activated_at = timezone.now()
-            user.save()
+            # Record the payment, start (or extend) the premium period and
+            # queue the receipt together. Saving the user drops their cached
+            # entitlement so the gates see it at once.
+            with transaction.atomic():
+                # M-Pesa retries callbacks; only the first completion may extend premium
+                first_completion = Payment.objects.filter(pk=payment.pk).exclude(status='completed').update(status='completed')
+                payment.save()
+                if first_completion:
+                    user = CustomUser.objects.select_for_update().get(pk=payment.user_id)
+                    user.premium_activated_at = renewal_start(user.is_premium, user.premium_activated_at)
+                    user.is_premium = True
+                    user.save(update_fields=['is_premium', 'premium_activated_at'])
+                    notify_payment_completed(payment)
             
         else:
             # Payment failed
@@ -182,10 +167,14 @@ def mpesa_callback(request):
         return JsonResponse({'error': 'Internal server error'}, status=500)
 
 @login_required
-def payment_status(request, payment_id):
+async def payment_status(request, payment_id):
     """Check payment status"""
-    payment = get_object_or_404(Payment, id=payment_id, user=request.user)
+    user = await request.auser()
+    payment = await aget_object_or_404(Payment, id=payment_id, user=user)
+    if payment.status == 'completed':
+        # The callback may have been handled by another worker with its own cache
+        await sync_to_async(invalidate_entitlements)(user.pk)
     
-    return render(request, 'payments/payment_status.html', {
+    return await sync_to_async(render)(request, 'payments/payment_status.html', {
         'payment': payment,
     })
\ No newline at end of file
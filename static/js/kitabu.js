@@ -0,0 +1,65 @@
+// Site-wide behaviour, loaded with defer from base.html. Each part only
+// runs on pages that have the elements it needs.
+
+// Mobile menu toggle
+(function () {
+    const button = document.getElementById('mobile-menu-button');
+    if (button) {
+        button.onclick = function () {
+            document.getElementById('mobile-menu').classList.toggle('hidden');
+        };
+    }
+})();
+
+// Masonry layout for the note list: each card spans as many grid rows as its height needs
+(function () {
+    document.querySelectorAll('.masonry-grid').forEach(grid => {
+        const items = Array.from(grid.children);
+
+        function resizeMasonryItem(item) {
+            const rowGap = parseInt(window.getComputedStyle(grid).getPropertyValue('grid-row-gap'));
+            const rowHeight = parseInt(window.getComputedStyle(grid).getPropertyValue('grid-auto-rows'));
+            const itemHeight = item.querySelector('div') ? item.querySelector('div').scrollHeight : item.scrollHeight; // Adjust if content is nested
+            const rowSpan = Math.ceil((itemHeight + rowGap) / (rowHeight + rowGap));
+            item.style.setProperty('--row-span', rowSpan);
+        }
+
+        function resizeAllMasonryItems() {
+            items.forEach(resizeMasonryItem);
+        }
+
+        resizeAllMasonryItems();
+        window.addEventListener('resize', resizeAllMasonryItems);
+    });
+})();
+
+// Live change notifications on the note page: only re-fetch the note when the server says it changed
+(function () {
+    const banner = document.getElementById('note-changed-banner');
+    if (!banner || !window.EventSource) {
+        return;
+    }
+    const text = document.getElementById('note-changed-text');
+    const action = document.getElementById('note-changed-action');
+    const listUrl = banner.dataset.listUrl;
+    const source = new EventSource(banner.dataset.eventsUrl);
+
+    function show(message, href, label) {
+        text.textContent = message;
+        action.href = href;
+        action.textContent = label;
+        banner.classList.remove('hidden');
+    }
+
+    source.addEventListener('changed', () => show('This note has been updated.', window.location.href, 'Reload'));
+    source.addEventListener('shared', () => show('Sharing for this note has changed.', window.location.href, 'Reload'));
+    source.addEventListener('unshared', () => show('Sharing for this note has changed.', window.location.href, 'Reload'));
+    source.addEventListener('deleted', () => {
+        source.close();
+        show('This note has been deleted.', listUrl, 'Back to notes');
+    });
+    source.addEventListener('revoked', () => {
+        source.close();
+        show('This note is no longer shared with you.', listUrl, 'Back to notes');
+    });
+})();
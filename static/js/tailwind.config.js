@@ -0,0 +1,13 @@
+// Theme for the Tailwind CDN build; loaded right after it in base.html
+tailwind.config = {
+    theme: {
+        extend: {
+            colors: {
+                'book-tan': '#fdf6e3',
+                'book-brown': '#8b4513',
+                'book-nav': '#d2b48c',
+                'book-footer': '#c2a57c',
+            }
+        }
+    }
+};